@@ -27,12 +27,17 @@
 
         'security/analytic_security.xml',
         'security/ir.model.access.csv',
+        'data/branch_analytic_balance_data.xml',
+        'data/branch_report_cache_data.xml',
+        'data/branch_report_export_job_data.xml',
+        'data/branch_draft_move_count_data.xml',
         'views/menu_item.xml',
         'views/assets.xml',
         'views/analytic_branch.xml',
         'views/account_move.xml',
         'views/branch_analytic_line.xml',
         'views/report_financial.xml',
+        'views/branch_report_export_job.xml',
         'views/search_template_view.xml',
         'wizard/multicurrency_revaluation.xml',
         'wizard/report_export_wizard.xml',
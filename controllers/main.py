@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+import json
+import os
+
+from odoo import http
+from odoo.http import content_disposition, request
+from odoo.http import serialize_exception as _serialize_exception
+from odoo.tools import html_escape
+
+
+class BranchReportController(http.Controller):
+
+    # output format: extension of the downloaded file
+    EXPORT_FORMATS = {
+        'pdf': 'pdf',
+        'xlsx': 'xlsx',
+        'xml': 'xml',
+        'txt': 'txt',
+    }
+
+    @http.route('/pcp_acc_nassag', type='http', auth='user', methods=['POST'], csrf=False)
+    def get_report(self, model, options, output_format, token, financial_id=None, **kw):
+        uid = request.session.uid
+        branch_report_model = request.env['branch.report']
+        options = json.loads(options)
+        cids = request.httprequest.cookies.get('cids', str(request.env.user.company_id.id))
+        allowed_company_ids = [int(cid) for cid in cids.split(',')]
+        report_obj = request.env[model].with_user(uid).with_context(allowed_company_ids=allowed_company_ids)
+        if financial_id and financial_id != 'null':
+            report_obj = report_obj.browse(int(financial_id))
+        try:
+            if output_format not in self.EXPORT_FORMATS:
+                raise ValueError('Unsupported export format: %s' % output_format)
+
+            # the stamp embeds the version of the reported data, the same export can be served as not modified
+            etag = report_obj._get_cache_key('get_%s' % output_format, options)
+            if etag in request.httprequest.if_none_match:
+                response = request.make_response(None, headers=[('ETag', '"%s"' % etag)])
+                response.status_code = 304
+            else:
+                export_file = report_obj._get_export_file(options, output_format)
+                report_name = '%s.%s' % (report_obj.get_report_filename(options), self.EXPORT_FORMATS[output_format])
+                response = request.make_response(
+                    self._iter_file(export_file, branch_report_model.FILE_CHUNK_SIZE),
+                    headers=[
+                        ('Content-Type', branch_report_model.get_export_mime_type(output_format)),
+                        ('Content-Length', str(os.fstat(export_file.fileno()).st_size)),
+                        ('Content-Disposition', content_disposition(report_name)),
+                        ('ETag', '"%s"' % etag),
+                        ('Cache-Control', 'private, no-cache'),
+                    ]
+                )
+                response.direct_passthrough = True
+            response.set_cookie('fileToken', token)
+            return response
+        except Exception as e:
+            se = _serialize_exception(e)
+            error = {
+                'code': 200,
+                'message': 'Odoo Server Error',
+                'data': se
+            }
+            return request.make_response(html_escape(json.dumps(error)))
+
+    @staticmethod
+    def _iter_file(export_file, chunk_size):
+        """ Stream the export by chunks, closing (thus deleting) the temporary file once sent. """
+        try:
+            for chunk in iter(lambda: export_file.read(chunk_size), b''):
+                yield chunk
+        finally:
+            export_file.close()
@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 from . import branch_report
 from . import analytic_branch
+from . import branch_analytic_balance
 from . import branch_analytic_report
 from . import branch_analytic_line
 from . import ir_actions
+from . import res_currency
+from . import branch_report_cache
+from . import branch_draft_move_count
+from . import account_move
+from . import branch_report_export_job
+from . import ir_attachment
+from . import account_journal
+from . import account_account
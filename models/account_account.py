@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+
+class AccountAccount(models.Model):
+    _inherit = 'account.account'
+
+    # The codes and names of the accounts are displayed by the cached branch reports of every period.
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        accounts = super(AccountAccount, self).create(vals_list)
+        accounts._bump_branch_report_data_version()
+        return accounts
+
+    def write(self, vals):
+        self._bump_branch_report_data_version()
+        res = super(AccountAccount, self).write(vals)
+        if 'company_id' in vals:
+            self._bump_branch_report_data_version()
+        return res
+
+    def unlink(self):
+        self._bump_branch_report_data_version()
+        return super(AccountAccount, self).unlink()
+
+    def _bump_branch_report_data_version(self):
+        self.env['branch.report.cache']._bump_data_version((account.company_id.id, False) for account in self)
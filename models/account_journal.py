@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+
+class AccountJournal(models.Model):
+    _inherit = 'account.journal'
+
+    # The journals are cached by the journal filter of the branch reports, see branch.report._get_filter_journal_ids.
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['branch.report'].clear_caches()
+        return super(AccountJournal, self).create(vals_list)
+
+    def write(self, vals):
+        self.env['branch.report'].clear_caches()
+        return super(AccountJournal, self).write(vals)
+
+    def unlink(self):
+        self.env['branch.report'].clear_caches()
+        return super(AccountJournal, self).unlink()
+
+
+class AccountJournalGroup(models.Model):
+    _inherit = 'account.journal.group'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['branch.report'].clear_caches()
+        return super(AccountJournalGroup, self).create(vals_list)
+
+    def write(self, vals):
+        self.env['branch.report'].clear_caches()
+        return super(AccountJournalGroup, self).write(vals)
+
+    def unlink(self):
+        self.env['branch.report'].clear_caches()
+        return super(AccountJournalGroup, self).unlink()
+
+
+class AccountGroup(models.Model):
+    _inherit = 'account.group'
+
+    # The groups are cached by the branch reports, see branch.report._has_account_groups and _get_group_codes_map,
+    # and their names are displayed by the cached reports of every period.
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['branch.report'].clear_caches()
+        groups = super(AccountGroup, self).create(vals_list)
+        groups._bump_branch_report_data_version()
+        return groups
+
+    def write(self, vals):
+        self.env['branch.report'].clear_caches()
+        self._bump_branch_report_data_version()
+        res = super(AccountGroup, self).write(vals)
+        if 'company_id' in vals:
+            self._bump_branch_report_data_version()
+        return res
+
+    def unlink(self):
+        self.env['branch.report'].clear_caches()
+        self._bump_branch_report_data_version()
+        return super(AccountGroup, self).unlink()
+
+    def _bump_branch_report_data_version(self):
+        self.env['branch.report.cache']._bump_data_version((group.company_id.id, False) for group in self)
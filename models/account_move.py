@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super(AccountMove, self).create(vals_list)
+        moves._apply_draft_move_count()
+        return moves
+
+    def write(self, vals):
+        # posting/cancelling a move does not write its lines but changes the reported figures
+        data_impacted = 'state' in vals or 'date' in vals
+        draft_count_impacted = any(
+            fname in vals for fname in self.env['branch.draft.move.daily.count']._KEY_FIELDS)
+        if data_impacted:
+            self.env['branch.report.cache']._bump_records_data_version(self)
+        if draft_count_impacted:
+            self._apply_draft_move_count(sign=-1)
+        res = super(AccountMove, self).write(vals)
+        if data_impacted:
+            self.env['branch.report.cache']._bump_records_data_version(self)
+        if draft_count_impacted:
+            self._apply_draft_move_count()
+        return res
+
+    def unlink(self):
+        self.env['branch.report.cache']._bump_records_data_version(self)
+        self._apply_draft_move_count(sign=-1)
+        return super(AccountMove, self).unlink()
+
+    def _apply_draft_move_count(self, sign=1):
+        DraftMoveCount = self.env['branch.draft.move.daily.count']
+        self.flush(DraftMoveCount._KEY_FIELDS)
+        DraftMoveCount._apply_moves(self.ids, sign=sign)
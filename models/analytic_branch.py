@@ -1,9 +1,14 @@
-from collections import defaultdict
-from odoo import api, fields, models, _
+from collections import defaultdict, namedtuple
+from odoo import api, fields, models, tools, _
 from odoo.osv import expression
+from odoo.tools import split_every
 from odoo.exceptions import ValidationError
 from odoo.exceptions import UserError
 
+# Values of a branch.analytic.distribution needed to generate the analytic lines, see
+# branch.analytic.tag._get_distribution_map().
+BranchDistribution = namedtuple('BranchDistribution', ['tag_id', 'account_id', 'group_id', 'company_id', 'percentage'])
+
 
 class BranchAnalyticDistribution(models.Model):
     _name = 'branch.analytic.distribution'
@@ -20,6 +25,29 @@ class BranchAnalyticDistribution(models.Model):
          'The percentage of an analytic distribution should be between 0 and 100.')
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['branch.analytic.tag'].clear_caches()
+        return super(BranchAnalyticDistribution, self).create(vals_list)
+
+    def write(self, vals):
+        self.env['branch.analytic.tag'].clear_caches()
+        return super(BranchAnalyticDistribution, self).write(vals)
+
+    def unlink(self):
+        self.env['branch.analytic.tag'].clear_caches()
+        return super(BranchAnalyticDistribution, self).unlink()
+
+    def _compile(self):
+        self.ensure_one()
+        return BranchDistribution(
+            tag_id=self.tag_id.id,
+            account_id=self.account_id.id,
+            group_id=self.account_id.group_id.id,
+            company_id=self.account_id.company_id.id,
+            percentage=self.percentage,
+        )
+
 
 class BranchAnalyticTag(models.Model):
     _name = 'branch.analytic.tag'
@@ -33,6 +61,34 @@ class BranchAnalyticTag(models.Model):
     analytic_distribution_ids = fields.One2many('branch.analytic.distribution', 'tag_id', string="Analytic branchs")
     company_id = fields.Many2one('res.company', string='Company')
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(BranchAnalyticTag, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(BranchAnalyticTag, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(BranchAnalyticTag, self).unlink()
+
+    @api.model
+    @tools.ormcache()
+    def _get_distribution_map(self):
+        """ Compiled analytic distributions of the tags having one, shared by the whole registry and invalidated when
+        the tags, the distributions or their branches change. The archived tags are included, as they are still set
+        on the journal items.
+
+        :return: A dictionary mapping a tag id to a tuple of BranchDistribution.
+        """
+        tags = self.sudo().with_context(active_test=False).search([('active_analytic_distribution', '=', True)])
+        return {
+            tag.id: tuple(distribution._compile() for distribution in tag.analytic_distribution_ids)
+            for tag in tags
+        }
+
 
 class BranchAnalyticDefault(models.Model):
     _name = "branch.analytic.default"
@@ -62,42 +118,116 @@ class BranchAnalyticDefault(models.Model):
         if any(not default.analytic_id and not default.branch_analytic_tag_ids for default in self):
             raise ValidationError(_('An analytic default requires at least an analytic account or an analytic tag.'))
 
+    # Dimensions of the rules, in the order of the account_get() parameters.
+    _RULE_DIMENSIONS = ['product_id', 'partner_id', 'account_id', 'user_id', 'company_id']
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(BranchAnalyticDefault, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(BranchAnalyticDefault, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(BranchAnalyticDefault, self).unlink()
+
+    @api.model
+    @tools.ormcache()
+    def _get_rule_index(self):
+        """ In-memory index of all the rules, invalidated on any rule change. The index is shared by all the users and
+        may still hold the rules removed by a database cascade (deleted product, partner, ...): the matching rules
+        are filtered by _get_accessible_rule_ids().
+
+        :return: A tuple (rules, index) where rules is the tuple of the rules sorted by sequence as
+                 (id, date_start, date_stop, score) and index maps each dimension of _RULE_DIMENSIONS to a dictionary
+                 {value or False: frozenset of positions in rules}.
+        """
+        records = self.sudo().search([], order='sequence, id')
+        rules = []
+        index = {dimension: defaultdict(set) for dimension in self._RULE_DIMENSIONS}
+        for position, rec in enumerate(records):
+            score = 0
+            for dimension in self._RULE_DIMENSIONS:
+                value = rec[dimension].id
+                index[dimension][value].add(position)
+                if value:
+                    score += 1
+            if rec.date_start:
+                score += 1
+            if rec.date_stop:
+                score += 1
+            rules.append((rec.id, rec.date_start, rec.date_stop, score))
+        index = {
+            dimension: {value: frozenset(positions) for value, positions in values.items()}
+            for dimension, values in index.items()
+        }
+        return tuple(rules), index
+
+    @api.model
+    def _find_rule_ids(self, rules, index, product_id=None, partner_id=None, account_id=None, user_id=None,
+                       date=None, company_id=None):
+        """ Ids of the rules of the index matching the given values, the best one first. """
+        values = {
+            'product_id': product_id,
+            'partner_id': partner_id,
+            'account_id': account_id,
+            'user_id': user_id,
+            'company_id': company_id,
+        }
+        candidates = None
+        for dimension in self._RULE_DIMENSIONS:
+            matching = index[dimension].get(False, frozenset())
+            if values[dimension]:
+                matching = matching | index[dimension].get(values[dimension], frozenset())
+            candidates = matching if candidates is None else candidates & matching
+            if not candidates:
+                return []
+
+        date = date and fields.Date.to_date(date)
+        matching_rules = []
+        for position in candidates:
+            rule_id, date_start, date_stop, score = rules[position]
+            if date and ((date_start and date_start > date) or (date_stop and date_stop < date)):
+                continue
+            # the highest score wins, then the first rule in sequence
+            matching_rules.append((-score, position, rule_id))
+        return [rule_id for _score, _position, rule_id in sorted(matching_rules)]
+
+    @api.model
+    def _get_accessible_rule_ids(self, rule_ids):
+        """ The rules of rule_ids that still exist and that the current user can read. """
+        return set(self.browse(rule_ids).exists()._filter_access_rules('read').ids)
+
     @api.model
     def account_get(self, product_id=None, partner_id=None, account_id=None, user_id=None, date=None, company_id=None):
-        domain = []
-        if product_id:
-            domain += ['|', ('product_id', '=', product_id)]
-        domain += [('product_id', '=', False)]
-        if partner_id:
-            domain += ['|', ('partner_id', '=', partner_id)]
-        domain += [('partner_id', '=', False)]
-        if account_id:
-            domain += ['|', ('account_id', '=', account_id)]
-        domain += [('account_id', '=', False)]
-        if company_id:
-            domain += ['|', ('company_id', '=', company_id)]
-        domain += [('company_id', '=', False)]
-        if user_id:
-            domain += ['|', ('user_id', '=', user_id)]
-        domain += [('user_id', '=', False)]
-        if date:
-            domain += ['|', ('date_start', '<=', date), ('date_start', '=', False)]
-            domain += ['|', ('date_stop', '>=', date), ('date_stop', '=', False)]
-        best_index = -1
-        res = self.env['branch.analytic.default']
-        for rec in self.search(domain):
-            index = 0
-            if rec.product_id: index += 1
-            if rec.partner_id: index += 1
-            if rec.account_id: index += 1
-            if rec.company_id: index += 1
-            if rec.user_id: index += 1
-            if rec.date_start: index += 1
-            if rec.date_stop: index += 1
-            if index > best_index:
-                res = rec
-                best_index = index
-        return res
+        return self.account_get_multi([(product_id, partner_id, account_id, user_id, date, company_id)])[0]
+
+    @api.model
+    def account_get_multi(self, keys):
+        """ Batch version of account_get().
+
+        :param keys:    A list of (product_id, partner_id, account_id, user_id, date, company_id) tuples.
+        :return:        A list holding the best rule (possibly an empty recordset) for each key, in the same order.
+        """
+        self.check_access_rights('read')
+        keys = [tuple(key) for key in keys]
+        rules, index = self._get_rule_index()
+        matching_rule_ids = {}
+        for key in keys:
+            if key not in matching_rule_ids:
+                product_id, partner_id, account_id, user_id, date, company_id = key
+                matching_rule_ids[key] = self._find_rule_ids(rules, index, product_id=product_id,
+                                                             partner_id=partner_id, account_id=account_id,
+                                                             user_id=user_id, date=date, company_id=company_id)
+        accessible_ids = self._get_accessible_rule_ids(
+            set(rule_id for rule_ids in matching_rule_ids.values() for rule_id in rule_ids))
+        return [
+            self.browse(next((rule_id for rule_id in matching_rule_ids[key] if rule_id in accessible_ids), False))
+            for key in keys
+        ]
 
 
 class BranchAnalyticLine(models.Model):
@@ -139,6 +269,149 @@ class BranchAnalyticLine(models.Model):
                 raise ValidationError(
                     _('The selected account belongs to another company than the one you\'re trying to create an analytic item for'))
 
+    def _apply_daily_balance(self, sign=1):
+        """ Report the contribution of these lines to branch.analytic.daily.balance. """
+        DailyBalance = self.env['branch.analytic.daily.balance']
+        if self:
+            self.flush(DailyBalance._KEY_FIELDS + ['amount'], self)
+        DailyBalance._apply_lines(self.ids, sign=sign)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super(BranchAnalyticLine, self).create(vals_list)
+        lines._apply_daily_balance()
+        self.env['branch.report.cache']._bump_records_data_version(lines)
+        return lines
+
+    def write(self, vals):
+        DailyBalance = self.env['branch.analytic.daily.balance']
+        balance_impacted = any(fname in vals for fname in DailyBalance._KEY_FIELDS + ['amount'])
+        if balance_impacted:
+            self._apply_daily_balance(sign=-1)
+        self.env['branch.report.cache']._bump_records_data_version(self)
+        res = super(BranchAnalyticLine, self).write(vals)
+        if balance_impacted:
+            self._apply_daily_balance()
+        if 'date' in vals or 'company_id' in vals:
+            self.env['branch.report.cache']._bump_records_data_version(self)
+        return res
+
+    def unlink(self):
+        self._apply_daily_balance(sign=-1)
+        self.env['branch.report.cache']._bump_records_data_version(self)
+        return super(BranchAnalyticLine, self).unlink()
+
+    # Columns _create_bulk() can insert directly, anything else goes through create().
+    _BULK_COLUMNS = [
+        'name', 'date', 'account_id', 'account', 'group_id', 'unit_amount', 'product_id', 'product_uom_id', 'amount',
+        'general_account_id', 'ref', 'move_id', 'user_id', 'partner_id', 'company_id',
+    ]
+    _BULK_BATCH_SIZE = 1000
+
+    @api.model
+    def _can_create_bulk(self, vals_list):
+        # an override of create() may change the values or do more than inserting the rows
+        if type(self).create is not BranchAnalyticLine.create:
+            return False
+        allowed_keys = set(self._BULK_COLUMNS) | {'tag_ids'}
+        for vals in vals_list:
+            if not set(vals) <= allowed_keys or 'date' not in vals or 'company_id' not in vals:
+                return False
+            tag_commands = vals.get('tag_ids') or []
+            if any(command[0] != 6 for command in tag_commands) or len(tag_commands) > 1:
+                return False
+        return True
+
+    @api.model
+    def _prepare_bulk_vals(self, vals_list):
+        """ Complete the values like create() does: the unknown fields are ignored, the missing ones get their
+        default value and the related fields are computed, the group from the analytic branch and the financial
+        account from the journal item.
+        """
+        related_fnames = ('group_id', 'general_account_id')
+        defaults = self.default_get([
+            fname for fname in self._BULK_COLUMNS + ['tag_ids'] if fname not in related_fnames
+        ])
+        branch_groups = {
+            branch.id: branch.group_id.id
+            for branch in self.env['res.branch'].browse(set(vals.get('account_id') for vals in vals_list) - {False})
+        }
+        move_line_accounts = {
+            move_line.id: move_line.account_id.id
+            for move_line in self.env['account.move.line'].sudo().browse(
+                set(vals.get('move_id') for vals in vals_list) - {False})
+        }
+        result = []
+        for vals in vals_list:
+            vals = dict(defaults, **{fname: value for fname, value in vals.items() if fname in self._fields})
+            vals['group_id'] = branch_groups.get(vals.get('account_id'), False)
+            vals['general_account_id'] = move_line_accounts.get(vals.get('move_id'), False)
+            result.append(vals)
+        return result
+
+    @api.model
+    def _create_bulk(self, vals_list):
+        """ Create the lines with multi-row INSERTs, tags included, falling back on create() when the values contain
+        anything else than plain columns and (6, 0, ids) tag commands. The values are completed like create() does
+        (defaults, related group) so the resulting rows are the same as the ones create() would produce.
+        """
+        if not vals_list:
+            return self.browse()
+        bulk_vals_list = self._prepare_bulk_vals(vals_list)
+        if not self._can_create_bulk(bulk_vals_list):
+            return self.create(vals_list)
+        vals_list = bulk_vals_list
+        self.check_access_rights('create')
+
+        company_currencies = {
+            company.id: company.currency_id.id
+            for company in self.env['res.company'].browse(set(vals['company_id'] for vals in vals_list))
+        }
+        now = fields.Datetime.now()
+        columns = ['create_uid', 'create_date', 'write_uid', 'write_date', 'currency_id'] + self._BULK_COLUMNS
+        line_ids = []
+        for batch in split_every(self._BULK_BATCH_SIZE, vals_list, list):
+            rows = []
+            for vals in batch:
+                row = [self._uid, now, self._uid, now, company_currencies[vals['company_id']]]
+                for fname in self._BULK_COLUMNS:
+                    value = vals.get(fname, False)
+                    row.append(None if value is False else value)
+                rows.append(tuple(row))
+            self._cr.execute(
+                'INSERT INTO branch_analytic_line (%s) VALUES %s RETURNING id' % (
+                    ', '.join('"%s"' % column for column in columns),
+                    ', '.join(['%s'] * len(rows)),
+                ),
+                rows,
+            )
+            batch_ids = [row[0] for row in self._cr.fetchall()]
+            line_ids += batch_ids
+
+            tag_rows = [
+                (line_id, tag_id)
+                for line_id, vals in zip(batch_ids, batch)
+                for tag_id in set(vals['tag_ids'][0][2] if vals.get('tag_ids') else [])
+            ]
+            if tag_rows:
+                self._cr.execute(
+                    'INSERT INTO branch_analytic_line_tag_rel (line_id, tag_id) VALUES %s ON CONFLICT DO NOTHING'
+                    % ', '.join(['%s'] * len(tag_rows)),
+                    tag_rows,
+                )
+
+        lines = self.browse(line_ids)
+        self.invalidate_cache()
+        # as create(), after the insertion
+        lines.check_access_rule('create')
+        lines._validate_fields(columns + ['tag_ids'])
+        lines._check_company()
+        lines._apply_daily_balance()
+        self.env['branch.report.cache']._bump_data_version(
+            (vals['company_id'], vals['date']) for vals in vals_list
+        )
+        return lines
+
 
 class BranchMoveLine(models.Model):
     _inherit = 'account.move.line'
@@ -147,27 +420,56 @@ class BranchMoveLine(models.Model):
                                                 store=True, readonly=False,
                                                check_company=True, copy=True)
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super(BranchMoveLine, self).create(vals_list)
+        self.env['branch.report.cache']._bump_records_data_version(lines)
+        return lines
+
+    def write(self, vals):
+        self.env['branch.report.cache']._bump_records_data_version(self)
+        res = super(BranchMoveLine, self).write(vals)
+        if 'date' in vals or 'company_id' in vals:
+            self.env['branch.report.cache']._bump_records_data_version(self)
+        return res
+
+    def unlink(self):
+        # The branch analytic lines are removed by the database cascade on move_id, not by their unlink().
+        analytic_lines = self.env['branch.analytic.line'].search([('move_id', 'in', self.ids)])
+        analytic_lines._apply_daily_balance(sign=-1)
+        self.env['branch.report.cache']._bump_records_data_version(self | analytic_lines)
+        return super(BranchMoveLine, self).unlink()
+
     def _get_branch_analytic_tag_ids(self):
         self.ensure_one()
-        return self.branch_analytic_tag_ids.filtered(lambda r: not r.active_analytic_distribution).ids
+        distribution_map = self.env['branch.analytic.tag']._get_distribution_map()
+        return [tag_id for tag_id in self.branch_analytic_tag_ids.ids if tag_id not in distribution_map]
 
     def create_analytic_lines(self):
         """ Create analytic items upon validation of an account.move.line having an analytic account or an analytic distribution.
         """
-        lines_to_create_analytic_entries = self.env['account.move.line']
+        # Fetch the relations used to prepare the values for all the lines at once instead of one line at a time.
+        self.mapped('move_id.invoice_user_id')
+        self.mapped('move_id.company_id')
+        self.mapped('partner_id.name')
+        self.mapped('analytic_account_id.group_id')
+        self.mapped('analytic_account_id.company_id')
+        self.mapped('analytic_tag_ids.active_analytic_distribution')
+        self.mapped('branch_analytic_tag_ids')
+
+        distribution_map = self.env['branch.analytic.tag']._get_distribution_map()
         analytic_line_vals = []
         for obj_line in self:
-            for tag in obj_line.branch_analytic_tag_ids.filtered('active_analytic_distribution'):
-                for distribution in tag.analytic_distribution_ids:
+            for tag_id in obj_line.branch_analytic_tag_ids.ids:
+                for distribution in distribution_map.get(tag_id, ()):
                     analytic_line_vals.append(obj_line._prepare_analytic_distribution_line(distribution))
-            if obj_line.analytic_account_id:
-                lines_to_create_analytic_entries |= obj_line
 
         # create analytic entries in batch
+        lines_to_create_analytic_entries = self.filtered('analytic_account_id')
         if lines_to_create_analytic_entries:
             analytic_line_vals += lines_to_create_analytic_entries._prepare_analytic_line()
 
-        self.env['branch.analytic.line'].create(analytic_line_vals)
+        self.env['branch.analytic.line']._create_bulk(analytic_line_vals)
 
     def _prepare_analytic_line(self):
         """ Prepare the values used to create() an account.analytic.line upon validation of an account.move.line having
@@ -203,18 +505,22 @@ class BranchMoveLine(models.Model):
     def _prepare_analytic_distribution_line(self, distribution):
         """ Prepare the values used to create() an account.analytic.line upon validation of an account.move.line having
             analytic tags with analytic distribution.
+            :param distribution: A BranchDistribution from branch.analytic.tag._get_distribution_map() or a
+                                 branch.analytic.distribution record.
         """
         self.ensure_one()
+        if isinstance(distribution, models.BaseModel):
+            distribution = distribution._compile()
         amount = -self.balance * distribution.percentage / 100.0
         default_name = self.name or (self.ref or '/' + ' -- ' + (self.partner_id and self.partner_id.name or '/'))
         return {
             'name': default_name,
             'date': self.date,
-            'account_id': distribution.account_id.id,
+            'account_id': distribution.account_id,
             'account': self.account_id.id,
-            'group_id': distribution.account_id.group_id.id,
+            'group_id': distribution.group_id,
             'partner_id': self.partner_id.id,
-            'tag_ids': [(6, 0, [distribution.tag_id.id] + self._get_analytic_tag_ids())],
+            'tag_ids': [(6, 0, [distribution.tag_id] + self._get_analytic_tag_ids())],
             'unit_amount': self.quantity,
             'product_id': self.product_id and self.product_id.id or False,
             'product_uom_id': self.product_uom_id and self.product_uom_id.id or False,
@@ -223,7 +529,7 @@ class BranchMoveLine(models.Model):
             'ref': self.ref,
             'move_id': self.id,
             'user_id': self.move_id.invoice_user_id.id or self._uid,
-            'company_id': distribution.account_id.company_id.id or self.env.company.id,
+            'company_id': distribution.company_id or self.env.company.id,
         }
 
 
@@ -242,7 +548,24 @@ class BranchAnalyticGroup(models.Model):
     complete_name = fields.Char('Complete Name', compute='_compute_complete_name', store=True)
     company_id = fields.Many2one('res.company', string='Company', default=lambda self: self.env.company)
 
-    @api.depends('name', 'parent_id.complete_name')
+    def init(self):
+        # Closure table holding every ancestor/descendant pair (a group being its own ancestor at depth 0).
+        self._cr.execute("""
+            CREATE TABLE IF NOT EXISTS branch_analytic_group_closure (
+                ancestor_id INTEGER NOT NULL REFERENCES branch_analytic_group(id) ON DELETE CASCADE,
+                descendant_id INTEGER NOT NULL REFERENCES branch_analytic_group(id) ON DELETE CASCADE,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            )
+        """)
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS branch_analytic_group_closure_descendant_idx
+            ON branch_analytic_group_closure (descendant_id, ancestor_id)
+        """)
+        self._refresh_closure()
+
+    # The descendants' complete_name are updated in SQL through the closure table, see _refresh_complete_name().
+    @api.depends('name', 'parent_id')
     def _compute_complete_name(self):
         for group in self:
             if group.parent_id:
@@ -250,6 +573,87 @@ class BranchAnalyticGroup(models.Model):
             else:
                 group.complete_name = group.name
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        groups = super(BranchAnalyticGroup, self).create(vals_list)
+        if groups:
+            groups._refresh_closure()
+        return groups
+
+    def write(self, vals):
+        if 'parent_id' in vals:
+            # the subtrees must be collected before the move
+            subtree = self.browse(self._get_descendant_ids())
+        else:
+            subtree = self
+        res = super(BranchAnalyticGroup, self).write(vals)
+        if 'parent_id' in vals and subtree:
+            subtree._refresh_closure()
+        if ('name' in vals or 'parent_id' in vals) and self:
+            self._refresh_complete_name()
+            self.env['branch.report.cache']._bump_data_version([(False, False)])
+        return res
+
+    def _refresh_closure(self):
+        """ (Re)build the closure rows of the groups in self, or of all the groups if self is empty, from their
+        parent_path.
+        """
+        self.flush(['parent_path'])
+        if self:
+            self._cr.execute("DELETE FROM branch_analytic_group_closure WHERE descendant_id IN %s", [tuple(self.ids)])
+            where_clause, params = "WHERE analytic_group.id IN %s", [tuple(self.ids)]
+        else:
+            self._cr.execute("DELETE FROM branch_analytic_group_closure")
+            where_clause, params = "", []
+        self._cr.execute("""
+            INSERT INTO branch_analytic_group_closure (ancestor_id, descendant_id, depth)
+            SELECT ancestor.id::integer, analytic_group.id, path.length - ancestor.position
+            FROM branch_analytic_group analytic_group
+            CROSS JOIN LATERAL (
+                SELECT string_to_array(rtrim(analytic_group.parent_path, '/'), '/') AS ids
+            ) AS path_ids
+            CROSS JOIN LATERAL (SELECT cardinality(path_ids.ids) AS length) AS path
+            CROSS JOIN LATERAL UNNEST(path_ids.ids) WITH ORDINALITY AS ancestor(id, position)
+            %s
+        """ % where_clause, params)
+
+    def _refresh_complete_name(self):
+        """ Recompute the complete_name of all the descendants of self in one query. """
+        self.flush(['name', 'complete_name', 'parent_path'])
+        self._cr.execute("""
+            UPDATE branch_analytic_group analytic_group
+            SET complete_name = names.complete_name
+            FROM (
+                SELECT closure.descendant_id, string_agg(ancestor.name, ' / ' ORDER BY closure.depth DESC) AS complete_name
+                FROM branch_analytic_group_closure closure
+                JOIN branch_analytic_group ancestor ON ancestor.id = closure.ancestor_id
+                WHERE closure.descendant_id IN (
+                    SELECT descendant_id FROM branch_analytic_group_closure WHERE ancestor_id IN %s AND depth > 0
+                )
+                GROUP BY closure.descendant_id
+            ) AS names
+            WHERE analytic_group.id = names.descendant_id
+        """, [tuple(self.ids)])
+        self.invalidate_cache(['complete_name'])
+
+    def _get_descendant_ids(self):
+        """ Ids of the groups in self and of all their descendants, read from the closure table. """
+        if not self:
+            return []
+        self._cr.execute("""
+            SELECT DISTINCT descendant_id FROM branch_analytic_group_closure WHERE ancestor_id IN %s
+        """, [tuple(self.ids)])
+        return [row[0] for row in self._cr.fetchall()]
+
+    def _get_ancestor_ids(self):
+        """ Ids of the groups in self and of all their ancestors, read from the closure table. """
+        if not self:
+            return []
+        self._cr.execute("""
+            SELECT DISTINCT ancestor_id FROM branch_analytic_group_closure WHERE descendant_id IN %s
+        """, [tuple(self.ids)])
+        return [row[0] for row in self._cr.fetchall()]
+
 
 class BrachAnalyticBranch(models.Model):
     _inherit = 'res.branch'
@@ -264,22 +668,71 @@ class BrachAnalyticBranch(models.Model):
         """
         res = super(BrachAnalyticBranch, self).read_group(domain, fields, groupby, offset=offset, limit=limit,
                                                           orderby=orderby, lazy=lazy)
-        accounts = self.env['res.branch']
+        amount_fields = [fname for fname in ('balance', 'debit', 'credit') if fname in fields]
+        if not amount_fields or not res:
+            return res
+
+        groupby = [groupby] if isinstance(groupby, str) else list(groupby)
+        groupby_fnames = groupby[:1] if lazy else groupby
+        if any(':' in gb or self._fields[gb].type in ('many2many', 'one2many', 'date', 'datetime')
+               for gb in groupby_fnames):
+            # Values that can't be used as keys as such, compute the groups one by one.
+            for line in res:
+                accounts = self.search(line['__domain']) if '__domain' in line else self.env['res.branch']
+                for fname in amount_fields:
+                    line[fname] = sum(accounts.mapped(fname))
+            return res
+
+        # Compute the amounts of all the matching branches at once, then dispatch them on the group rows.
+        def group_key(values):
+            return tuple(values[gb][0] if isinstance(values[gb], (list, tuple)) else values[gb]
+                         for gb in groupby_fnames)
+
+        accounts = self.search(domain)
+        totals = defaultdict(lambda: dict.fromkeys(amount_fields, 0.0))
+        for values in accounts.read(groupby_fnames + amount_fields):
+            key = group_key(values)
+            for fname in amount_fields:
+                totals[key][fname] += values[fname]
         for line in res:
-            if '__domain' in line:
-                accounts = self.search(line['__domain'])
-            if 'balance' in fields:
-                line['balance'] = sum(accounts.mapped('balance'))
-            if 'debit' in fields:
-                line['debit'] = sum(accounts.mapped('debit'))
-            if 'credit' in fields:
-                line['credit'] = sum(accounts.mapped('credit'))
+            line.update(totals.get(group_key(line), dict.fromkeys(amount_fields, 0.0)))
         return res
 
+    @api.model
+    def _query_debit_credit_balance(self, domain):
+        """ Sum the debit and credit of the branch analytic lines matching the domain in one grouped query,
+        reading the daily balances instead of the raw lines whenever the domain allows it.
+
+        :param domain:  A domain on branch.analytic.line.
+        :return:        A list of (account_id, currency_id, debit, credit) tuples.
+        """
+        daily_balance_obj = self.env['branch.analytic.daily.balance']
+        if daily_balance_obj._supports_domain(domain):
+            line_obj = daily_balance_obj
+            debit_select = 'SUM("{table}".debit)'
+            credit_select = 'SUM("{table}".credit)'
+        else:
+            line_obj = self.env['branch.analytic.line']
+            debit_select = 'SUM(CASE WHEN "{table}".amount < 0 THEN -"{table}".amount ELSE 0 END)'
+            credit_select = 'SUM(CASE WHEN "{table}".amount >= 0 THEN "{table}".amount ELSE 0 END)'
+        line_obj.check_access_rights('read')
+        # the fields of the domain (tags, ...) and the summed ones
+        line_obj._flush_search(domain, fields=['account_id', 'currency_id', 'amount'])
+        query = line_obj._where_calc(domain)
+        line_obj._apply_ir_rules(query, 'read')
+        from_clause, where_clause, where_params = query.get_sql()
+        self._cr.execute(("""
+            SELECT "{table}".account_id, "{table}".currency_id, %s, %s
+            FROM %s
+            WHERE %s
+            GROUP BY "{table}".account_id, "{table}".currency_id
+        """ % (debit_select, credit_select, from_clause, where_clause or 'TRUE')).replace('{table}', line_obj._table),
+            where_params)
+        return self._cr.fetchall()
+
     @api.depends('line_ids.amount')
     def _compute_debit_credit_balance(self):
         Curr = self.env['res.currency']
-        analytic_line_obj = self.env['branch.analytic.line']
         domain = [
             ('account_id', 'in', self.ids),
             ('company_id', 'in', [False] + self.env.companies.ids)
@@ -293,34 +746,23 @@ class BrachAnalyticBranch(models.Model):
             domain = expression.AND([domain, tag_domain])
 
         user_currency = self.env.company.currency_id
-        credit_groups = analytic_line_obj.read_group(
-            domain=domain + [('amount', '>=', 0.0)],
-            fields=['account_id', 'currency_id', 'amount'],
-            groupby=['account_id', 'currency_id'],
-            lazy=False,
-        )
-        data_credit = defaultdict(float)
-        for l in credit_groups:
-            data_credit[l['account_id'][0]] += Curr.browse(l['currency_id'][0])._convert(
-                l['amount'], user_currency, self.env.company, fields.Date.today())
-
-        debit_groups = analytic_line_obj.read_group(
-            domain=domain + [('amount', '<', 0.0)],
-            fields=['account_id', 'currency_id', 'amount'],
-            groupby=['account_id', 'currency_id'],
-            lazy=False,
-        )
+        rows = self._query_debit_credit_balance(domain) if self.ids else []
+
+        # Convert once per currency instead of once per result row.
+        rate_table = Curr._get_branch_rate_table(self.env.company, fields.Date.today())
+        rate_table.prefetch(Curr.browse(set(row[1] for row in rows)) | user_currency)
         data_debit = defaultdict(float)
-        for l in debit_groups:
-            data_debit[l['account_id'][0]] += Curr.browse(l['currency_id'][0])._convert(
-                l['amount'], user_currency, self.env.company, fields.Date.today())
+        data_credit = defaultdict(float)
+        for account_id, currency_id, debit, credit in rows:
+            currency = Curr.browse(currency_id)
+            data_debit[account_id] += rate_table.convert(debit, currency, user_currency)
+            data_credit[account_id] += rate_table.convert(credit, currency, user_currency)
 
         for account in self:
-            account.debit = abs(data_debit.get(account.id, 0.0))
+            account.debit = data_debit.get(account.id, 0.0)
             account.credit = data_credit.get(account.id, 0.0)
             account.balance = account.credit - account.debit
 
-
     code = fields.Char(string='Reference', index=True, tracking=True)
     active = fields.Boolean('Active',
                             help="If the active field is set to False, it will allow you to hide the account without removing it.",
@@ -341,6 +783,18 @@ class BrachAnalyticBranch(models.Model):
 
     currency_id = fields.Many2one(related="company_id.currency_id", string="Currency", readonly=True)
 
+    def write(self, vals):
+        res = super(BrachAnalyticBranch, self).write(vals)
+        if 'group_id' in vals or 'company_id' in vals:
+            self.env['branch.analytic.tag'].clear_caches()
+        if 'group_id' in vals:
+            # group_id is a stored related on the lines, recomputed without going through their write()
+            self.env['branch.analytic.daily.balance']._rebuild(branch_ids=self.ids)
+        if self:
+            # the branches are displayed by the reports of every period
+            self.env['branch.report.cache']._bump_data_version([(False, False)])
+        return res
+
     def name_get(self):
         res = []
         for analytic in self:
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class BranchAnalyticDailyBalance(models.Model):
+    """ Daily aggregate of the branch analytic lines.
+
+    The table is an append-only log of deltas written by branch.analytic.line create/write/unlink: the balance of
+    a company, analytic branch, general account, analytic group, currency and day is the sum of its rows, so the
+    balances can be read without scanning the raw lines. Concurrent postings only insert rows and never wait on
+    the rows of each other. A daily cron compacts the rows (see _compact), one row being left per key having
+    lines. Use check_consistency() / rebuild() after bulk loads done outside of the ORM.
+    """
+    _name = 'branch.analytic.daily.balance'
+    _description = 'Analytic Branch Daily Balance'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    # fields of branch.analytic.line defining an aggregate row
+    _KEY_FIELDS = ['company_id', 'account_id', 'account', 'group_id', 'currency_id', 'date']
+
+    company_id = fields.Many2one('res.company', string='Company', required=True, readonly=True)
+    account_id = fields.Many2one('res.branch', string='Analytic Branch', required=True, readonly=True, index=True)
+    account = fields.Many2one('account.account', string='Account Branch analytic', required=True, readonly=True)
+    group_id = fields.Many2one('branch.analytic.group', string='Group', readonly=True, index=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    date = fields.Date(string='Date', required=True, readonly=True, index=True)
+    amount = fields.Monetary(string='Amount', readonly=True)
+    debit = fields.Monetary(string='Debit', readonly=True,
+                            help="Sum of the absolute value of the negative amounts of the day.")
+    credit = fields.Monetary(string='Credit', readonly=True,
+                             help="Sum of the positive amounts of the day.")
+    line_count = fields.Integer(string='# Lines', readonly=True)
+
+    def init(self):
+        # the rows are deltas, several rows per key
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS branch_analytic_daily_balance_key_idx
+            ON branch_analytic_daily_balance (company_id, account_id, account, COALESCE(group_id, 0), currency_id, date)
+        """)
+        self._cr.execute("SELECT 1 FROM branch_analytic_daily_balance LIMIT 1")
+        if not self._cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _supports_domain(self, domain):
+        """ Whether a branch.analytic.line domain can be evaluated on the aggregate instead of the raw lines. """
+        return all(
+            not isinstance(leaf, (list, tuple)) or leaf[0].split('.')[0] in self._KEY_FIELDS
+            for leaf in domain
+        )
+
+    @api.model
+    def _apply_lines(self, line_ids, sign=1):
+        """ Add (sign=1) or remove (sign=-1) the contribution of the given branch.analytic.line ids. The lines
+        must be flushed to the database beforehand.
+        """
+        if not line_ids:
+            return
+        self._cr.execute("""
+            INSERT INTO branch_analytic_daily_balance
+                (company_id, account_id, account, group_id, currency_id, date, amount, debit, credit, line_count)
+            SELECT line.company_id, line.account_id, line.account, line.group_id, line.currency_id, line.date,
+                   %(sign)s * SUM(line.amount),
+                   %(sign)s * SUM(CASE WHEN line.amount < 0 THEN -line.amount ELSE 0 END),
+                   %(sign)s * SUM(CASE WHEN line.amount >= 0 THEN line.amount ELSE 0 END),
+                   %(sign)s * COUNT(*)
+            FROM branch_analytic_line line
+            WHERE line.id IN %(line_ids)s
+            GROUP BY line.company_id, line.account_id, line.account, line.group_id, line.currency_id, line.date
+        """, {'sign': sign, 'line_ids': tuple(line_ids)})
+        self.invalidate_cache()
+
+    @api.model
+    def _compact(self):
+        """ Merge the deltas of every key in a single row, removing the keys without lines. The rows inserted by
+        concurrent transactions are not visible to the statement and are left for the next run.
+        """
+        self._cr.execute("""
+            WITH compacted AS (
+                DELETE FROM branch_analytic_daily_balance
+                WHERE (company_id, account_id, account, COALESCE(group_id, 0), currency_id, date) IN (
+                    SELECT company_id, account_id, account, COALESCE(group_id, 0), currency_id, date
+                    FROM branch_analytic_daily_balance
+                    GROUP BY company_id, account_id, account, COALESCE(group_id, 0), currency_id, date
+                    HAVING COUNT(*) > 1 OR SUM(line_count) <= 0
+                )
+                RETURNING company_id, account_id, account, group_id, currency_id, date, amount, debit, credit,
+                          line_count
+            )
+            INSERT INTO branch_analytic_daily_balance
+                (company_id, account_id, account, group_id, currency_id, date, amount, debit, credit, line_count)
+            SELECT company_id, account_id, account, group_id, currency_id, date,
+                   SUM(amount), SUM(debit), SUM(credit), SUM(line_count)
+            FROM compacted
+            GROUP BY company_id, account_id, account, group_id, currency_id, date
+            HAVING SUM(line_count) > 0
+        """)
+        self.invalidate_cache()
+
+    @api.model
+    def _rebuild(self, branch_ids=None):
+        """ Recompute the aggregate from the raw lines, for the given analytic branches or for all of them. """
+        self.env['branch.analytic.line'].flush(self._KEY_FIELDS + ['amount'])
+        where_clause = branch_ids is not None and 'WHERE line.account_id IN %(branch_ids)s' or ''
+        params = {'branch_ids': tuple(branch_ids or [0])}
+        self._cr.execute("DELETE FROM branch_analytic_daily_balance line %s" % where_clause, params)
+        self._cr.execute("""
+            INSERT INTO branch_analytic_daily_balance
+                (company_id, account_id, account, group_id, currency_id, date, amount, debit, credit, line_count)
+            SELECT line.company_id, line.account_id, line.account, line.group_id, line.currency_id, line.date,
+                   SUM(line.amount),
+                   SUM(CASE WHEN line.amount < 0 THEN -line.amount ELSE 0 END),
+                   SUM(CASE WHEN line.amount >= 0 THEN line.amount ELSE 0 END),
+                   COUNT(*)
+            FROM branch_analytic_line line
+            %s
+            GROUP BY line.company_id, line.account_id, line.account, line.group_id, line.currency_id, line.date
+        """ % where_clause, params)
+        self.invalidate_cache()
+
+    def _get_inconsistencies(self):
+        """ Compare the aggregate with the raw lines.
+
+        :return: A list of dictionaries, one per aggregate key whose stored values differ from the raw lines.
+        """
+        self.env['branch.analytic.line'].flush(self._KEY_FIELDS + ['amount'])
+        self._cr.execute("""
+            WITH raw AS (
+                SELECT line.company_id, line.account_id, line.account, line.group_id, line.currency_id, line.date,
+                       SUM(line.amount) AS amount,
+                       SUM(CASE WHEN line.amount < 0 THEN -line.amount ELSE 0 END) AS debit,
+                       SUM(CASE WHEN line.amount >= 0 THEN line.amount ELSE 0 END) AS credit,
+                       COUNT(*) AS line_count
+                FROM branch_analytic_line line
+                GROUP BY line.company_id, line.account_id, line.account, line.group_id, line.currency_id, line.date
+            ),
+            agg AS (
+                SELECT balance.company_id, balance.account_id, balance.account, balance.group_id,
+                       balance.currency_id, balance.date,
+                       SUM(balance.amount) AS amount, SUM(balance.debit) AS debit, SUM(balance.credit) AS credit,
+                       SUM(balance.line_count) AS line_count
+                FROM branch_analytic_daily_balance balance
+                GROUP BY balance.company_id, balance.account_id, balance.account, balance.group_id,
+                         balance.currency_id, balance.date
+                -- the keys whose lines have all been removed until the next compaction
+                HAVING SUM(balance.line_count) != 0 OR SUM(balance.amount) != 0
+                    OR SUM(balance.debit) != 0 OR SUM(balance.credit) != 0
+            )
+            SELECT COALESCE(raw.company_id, agg.company_id) AS company_id,
+                   COALESCE(raw.account_id, agg.account_id) AS account_id,
+                   COALESCE(raw.account, agg.account) AS account,
+                   COALESCE(raw.group_id, agg.group_id) AS group_id,
+                   COALESCE(raw.currency_id, agg.currency_id) AS currency_id,
+                   COALESCE(raw.date, agg.date) AS date,
+                   raw.amount AS expected_amount, agg.amount AS stored_amount,
+                   raw.line_count AS expected_line_count, agg.line_count AS stored_line_count
+            FROM raw
+            FULL OUTER JOIN agg
+                ON agg.company_id = raw.company_id
+                AND agg.account_id = raw.account_id
+                AND agg.account = raw.account
+                AND COALESCE(agg.group_id, 0) = COALESCE(raw.group_id, 0)
+                AND agg.currency_id = raw.currency_id
+                AND agg.date = raw.date
+            WHERE raw.account_id IS NULL
+                OR agg.account_id IS NULL
+                OR agg.amount != raw.amount
+                OR agg.debit != raw.debit
+                OR agg.credit != raw.credit
+                OR agg.line_count != raw.line_count
+        """)
+        return self._cr.dictfetchall()
+
+    @api.model
+    def check_consistency(self):
+        """ Verify the aggregate against the raw branch.analytic.line table.
+
+        :return: The number of aggregate keys that don't match the raw lines.
+        """
+        self.check_access_rights('read')
+        inconsistencies = self._get_inconsistencies()
+        for row in inconsistencies[:20]:
+            _logger.warning("Inconsistent branch analytic daily balance: %s", row)
+        if inconsistencies:
+            _logger.warning("%s inconsistent branch analytic daily balances found.", len(inconsistencies))
+        return len(inconsistencies)
+
+    @api.model
+    def rebuild(self, only_if_inconsistent=False):
+        """ Recompute the whole aggregate from the raw branch.analytic.line table, e.g. after a bulk load.
+
+        :param only_if_inconsistent: Skip the rebuild when check_consistency() doesn't report any difference.
+        :return: True if the aggregate has been rebuilt.
+        """
+        self.check_access_rights('unlink')
+        if only_if_inconsistent and not self.check_consistency():
+            return False
+        self._rebuild()
+        _logger.info("Branch analytic daily balances rebuilt.")
+        return True
@@ -17,12 +17,16 @@ class branch_analytic_report(models.AbstractModel):
     filter_analytic = True
     filter_hierarchy = False
     filter_unfold_all = False
+    order_selected_column = {'default': 0}
+
+    # number of the balance column, as in options['selected_column']
+    BALANCE_COLUMN = 4
 
     def _get_columns_name(self, options):
         return [{'name': ''},
                 {'name': _('Reference')},
                 {'name': _('Partner')},
-                {'name': _('Balance'), 'class': 'number'}]
+                {'name': _('Balance'), 'class': 'number sortable'}]
 
     @api.model
     def _get_report_name(self):
@@ -45,31 +49,90 @@ class branch_analytic_report(models.AbstractModel):
         return action
 
     def _get_amount_of_parents(self, group):
-        return self.env['branch.analytic.group'].search_count([('id', 'parent_of', group.id)])
+        return len(group._get_ancestor_ids())
 
     def _get_balance_for_group(self, group, analytic_line_domain):
         analytic_line_domain_for_group = list(analytic_line_domain)
         if group:
             # take into account the hierarchy on account.analytic.line
-            analytic_line_domain_for_group += [('group_id', 'child_of', group.id)]
+            analytic_line_domain_for_group += [('group_id', 'in', group._get_descendant_ids())]
         else:
             analytic_line_domain_for_group += [('group_id', '=', False)]
 
         currency_obj = self.env['res.currency']
         user_currency = self.env.company.currency_id
-        analytic_lines = self.env['branch.analytic.line'].read_group(analytic_line_domain_for_group, ['amount', 'currency_id'], ['currency_id'])
-        balance = sum([currency_obj.browse(row['currency_id'][0])._convert(
-            row['amount'], user_currency, self.env.company, fields.Date.today()) for row in analytic_lines])
+        if self.env['branch.analytic.daily.balance']._supports_domain(analytic_line_domain_for_group):
+            # no filter on the tags, the daily balances are enough
+            line_obj = self.env['branch.analytic.daily.balance']
+        else:
+            line_obj = self.env['branch.analytic.line']
+        analytic_lines = line_obj.read_group(analytic_line_domain_for_group, ['amount', 'currency_id'], ['currency_id'])
+        rate_table = currency_obj._get_branch_rate_table(self.env.company, fields.Date.today())
+        rate_table.prefetch(currency_obj.browse([row['currency_id'][0] for row in analytic_lines]) | user_currency)
+        balance = sum([rate_table.convert(row['amount'], currency_obj.browse(row['currency_id'][0]), user_currency)
+                       for row in analytic_lines])
         return balance
 
-    def _generate_analytic_group_line(self, group, analytic_line_domain, unfolded=False):
+    def _get_group_balances(self, analytic_line_domain):
+        """ Compute the rolled-up balance and the depth of every analytic group in a single query: the amount of each
+        group is added to all the groups of its parent_path.
+
+        :param analytic_line_domain:    A domain on branch.analytic.line.
+        :return:                        A dictionary {group_id: (balance, depth)}, the lines without a group being
+                                        under the False key.
+        """
+        currency_obj = self.env['res.currency']
+        user_currency = self.env.company.currency_id
+        if self.env['branch.analytic.daily.balance']._supports_domain(analytic_line_domain):
+            # no filter on the tags, the daily balances are enough
+            line_obj = self.env['branch.analytic.daily.balance']
+        else:
+            line_obj = self.env['branch.analytic.line']
+        line_obj.check_access_rights('read')
+        line_obj.flush(['group_id', 'currency_id', 'amount'])
+        self.env['branch.analytic.group'].flush(['parent_path'])
+        query = line_obj._where_calc(analytic_line_domain)
+        line_obj._apply_ir_rules(query, 'read')
+        from_clause, where_clause, where_params = query.get_sql()
+        self._cr.execute('''
+            WITH amounts AS (
+                SELECT "{table}".group_id, "{table}".currency_id, SUM("{table}".amount) AS amount
+                FROM %s
+                WHERE %s
+                GROUP BY "{table}".group_id, "{table}".currency_id
+            )
+            SELECT ancestor.id::integer, ancestor.depth, amounts.currency_id, SUM(amounts.amount)
+            FROM amounts
+            LEFT JOIN branch_analytic_group analytic_group ON analytic_group.id = amounts.group_id
+            CROSS JOIN LATERAL UNNEST(string_to_array(rtrim(COALESCE(analytic_group.parent_path, '0/'), '/'), '/'))
+                WITH ORDINALITY AS ancestor(id, depth)
+            GROUP BY ancestor.id, ancestor.depth, amounts.currency_id
+        '''.replace('{table}', line_obj._table) % (from_clause, where_clause or 'TRUE'), where_params)
+        rows = self._cr.fetchall()
+
+        rate_table = currency_obj._get_branch_rate_table(self.env.company, fields.Date.today())
+        rate_table.prefetch(currency_obj.browse(set(row[2] for row in rows)) | user_currency)
+        group_balances = {}
+        for group_id, depth, currency_id, amount in rows:
+            group_id = group_id or False
+            balance = group_balances.get(group_id, (0.0, depth))[0]
+            balance += rate_table.convert(amount, currency_obj.browse(currency_id), user_currency)
+            group_balances[group_id] = (balance, depth)
+        return group_balances
+
+    def _generate_analytic_group_line(self, group, analytic_line_domain, unfolded=False, group_balances=None):
         LOWEST_LEVEL = 1
-        balance = self._get_balance_for_group(group, analytic_line_domain)
+        if group_balances is None:
+            balance = self._get_balance_for_group(group, analytic_line_domain)
+            depth = self._get_amount_of_parents(group) if group else 0
+        else:
+            depth = len(group.parent_path.strip('/').split('/')) if group else 0
+            balance, depth = group_balances.get(group.id, (0.0, depth))
 
         line = {
-            'columns': [{'name': ''},
-                        {'name': ''},
-                        {'name': self.format_value(balance)}],
+            'columns': [self._build_cell(''),
+                        self._build_cell(''),
+                        self._build_cell(balance, 'currency')],
             'unfoldable': True,
             'unfolded': unfolded,
         }
@@ -78,7 +141,7 @@ class branch_analytic_report(models.AbstractModel):
             line.update({
                 'id': group.id,
                 'name': group.name,
-                'level': LOWEST_LEVEL + self._get_amount_of_parents(group),
+                'level': LOWEST_LEVEL + depth,
                 'parent_id': group.account.id,  # to make these fold when the original parent gets folded
             })
         else:
@@ -94,13 +157,14 @@ class branch_analytic_report(models.AbstractModel):
     def _generate_analytic_account_lines(self, analytic_accounts, parent_id=False):
         lines = []
 
-        for account in analytic_accounts:
+        amounts = analytic_accounts.mapped('amount')
+        for account, amount, formatted_amount in zip(analytic_accounts, amounts, self.format_values(amounts)):
             lines.append({
                 'id': 'analytic_account_%s' % account.id,
                 'name': account.account.name,
-                'columns': [{'name': account.code},
-                            {'name': account.name},
-                            {'name': self.format_value(account.amount)}],
+                'columns': [self._build_cell(account.code),
+                            self._build_cell(account.name),
+                            self._build_cell(amount, 'currency', name=formatted_amount)],
                 'level': 4,  # todo check redesign financial reports, should be level + 1 but doesn't look good
                 'unfoldable': False,
                 'caret_options': 'branch.analytic.line',
@@ -109,8 +173,31 @@ class branch_analytic_report(models.AbstractModel):
 
         return lines
 
+    def _get_analytic_account_lines_page(self, analytic_accounts_obj, analytic_account_domain, options, parent_id=False,
+                                         offset=0, progress=0.0, remaining=0):
+        """ Render a window of analytic lines starting at offset, followed by a 'load more' line if some are left.
+        Only the lines of the window are fetched.
+        """
+        limit = self._get_lines_page_size(options)
+        # when sorted on the balance, the pages are sorted by the query: the first page holds the top lines
+        order = self._get_order_by_selected_column(options, {self.BALANCE_COLUMN: 'amount'})
+        analytic_accounts = analytic_accounts_obj.search(analytic_account_domain, offset=offset, limit=limit,
+                                                         order=order and '%s, id DESC' % order)
+        lines = self._generate_analytic_account_lines(analytic_accounts, parent_id)
+
+        if limit and len(analytic_accounts) == limit:
+            if offset:
+                remaining -= len(analytic_accounts)
+            else:
+                remaining = analytic_accounts_obj.search_count(analytic_account_domain) - len(analytic_accounts)
+            if remaining > 0:
+                progress += sum(analytic_accounts.mapped('amount'))
+                lines.append(self._get_load_more_line(options, parent_id, offset + len(analytic_accounts),
+                                                      progress, remaining))
+        return lines
+
     @api.model
-    def _get_lines(self, options, line_id=None):
+    def _get_lines(self, options, line_id=None, group_balances=None):
         BranchAnalyticGroup = self.env['branch.analytic.group']
         lines = []
         parent_group = BranchAnalyticGroup
@@ -146,32 +233,51 @@ class branch_analytic_report(models.AbstractModel):
 
         analytic_account_domain += ['|', ('company_id', 'in', company_ids), ('company_id', '=', False)]
 
+        if line_id and line_id.startswith('loadmore_'):
+            # next page of the lines of an unfolded group, or of the whole report without hierarchy
+            parent_id = line_id[len('loadmore_'):]
+            if parent_id == self.DUMMY_GROUP_ID:
+                analytic_account_domain += [('group_id', '=', False)]
+            elif parent_id:
+                parent_id = int(parent_id)
+                analytic_account_domain += [('group_id', '=', parent_id)]
+            offset, progress, remaining = self._get_lines_window(options)
+            return self._get_analytic_account_lines_page(BranchAnalyticBranch, analytic_account_domain, options,
+                                                         parent_id=parent_id or False, offset=offset,
+                                                         progress=progress, remaining=remaining)
+
         if not options.get('hierarchy'):
-            return self._generate_analytic_account_lines(BranchAnalyticBranch.search(analytic_account_domain))
+            return self._get_analytic_account_lines_page(BranchAnalyticBranch, analytic_account_domain, options)
 
         # display all groups that have accounts
-        analytic_accounts = BranchAnalyticBranch.search(analytic_account_domain)
-        analytic_groups = analytic_accounts.mapped('group_id')
+        group_rows = BranchAnalyticBranch.read_group(analytic_account_domain, ['group_id'], ['group_id'])
+        analytic_groups = BranchAnalyticGroup.browse([row['group_id'][0] for row in group_rows if row['group_id']])
+        has_lines_without_group = any(not row['group_id'] for row in group_rows)
 
         # also include the parent analytic groups, even if they didn't have a child analytic line
         if analytic_groups:
-            analytic_groups = BranchAnalyticGroup.search([('id', 'parent_of', analytic_groups.ids)])
+            analytic_groups = BranchAnalyticGroup.search([('id', 'in', analytic_groups._get_ancestor_ids())])
 
         domain = [('id', 'in', analytic_groups.ids)]
 
+        # the balances of all the groups are computed at once and shared with the unfolded groups
+        if group_balances is None:
+            group_balances = self._get_group_balances(analytic_entries_domain)
+
         if line_id:
             parent_group = BranchAnalyticGroup if line_id == self.DUMMY_GROUP_ID else BranchAnalyticGroup.browse(int(line_id))
             domain += [('parent_id', '=', parent_group.id)]
 
             # the engine replaces line_id with what is returned so
             # first re-render the line that was just clicked
-            lines.append(self._generate_analytic_group_line(parent_group, analytic_entries_domain, unfolded=True))
+            lines.append(self._generate_analytic_group_line(parent_group, analytic_entries_domain, unfolded=True,
+                                                            group_balances=group_balances))
 
             # append analytic accounts part of this group, taking into account the selected options
             analytic_account_domain += [('group_id', '=', parent_group.id)]
 
-            analytic_accounts = BranchAnalyticBranch.search(analytic_account_domain)
-            lines += self._generate_analytic_account_lines(analytic_accounts, parent_group.id if parent_group else self.DUMMY_GROUP_ID)
+            lines += self._get_analytic_account_lines_page(BranchAnalyticBranch, analytic_account_domain, options,
+                                                           parent_group.id if parent_group else self.DUMMY_GROUP_ID)
         else:
             domain += [('parent_id', '=', False)]
 
@@ -179,16 +285,18 @@ class branch_analytic_report(models.AbstractModel):
         if line_id != self.DUMMY_GROUP_ID:
             for group in BranchAnalyticGroup.search(domain):
                 if group.id in options.get('unfolded_lines') or options.get('unfold_all'):
-                    lines += self._get_lines(options, line_id=str(group.id))
+                    lines += self._get_lines(options, line_id=str(group.id), group_balances=group_balances)
                 else:
-                    lines.append(self._generate_analytic_group_line(group, analytic_entries_domain))
+                    lines.append(self._generate_analytic_group_line(group, analytic_entries_domain,
+                                                                    group_balances=group_balances))
 
         # finally append a 'dummy' group which contains the accounts that do not have an analytic group
-        if not line_id and any(not account.group_id for account in analytic_accounts):
+        if not line_id and has_lines_without_group:
             if self.DUMMY_GROUP_ID in options.get('unfolded_lines'):
-                lines += self._get_lines(options, line_id=self.DUMMY_GROUP_ID)
+                lines += self._get_lines(options, line_id=self.DUMMY_GROUP_ID, group_balances=group_balances)
             else:
-                lines.append(self._generate_analytic_group_line(BranchAnalyticGroup, analytic_entries_domain))
+                lines.append(self._generate_analytic_group_line(BranchAnalyticGroup, analytic_entries_domain,
+                                                                group_balances=group_balances))
 
         return lines
 
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+
+class BranchDraftMoveDailyCount(models.Model):
+    """ Number of draft journal entries per company and day.
+
+    The table is an append-only log of deltas written by account.move create/write/unlink: the count of a day is
+    the sum of its rows. Posting entries of the same day in concurrent transactions only inserts rows, the
+    transactions never update the same row, so they neither wait for each other nor fail with serialization
+    errors. A daily cron compacts the rows (see _compact), the days without draft entries having no row left.
+    The reports can tell whether a period has unposted entries without scanning account_move.
+    """
+    _name = 'branch.draft.move.daily.count'
+    _description = 'Draft Journal Entries per Day'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    # fields of account.move defining a row
+    _KEY_FIELDS = ['company_id', 'date', 'state']
+
+    company_id = fields.Many2one('res.company', string='Company', required=True, readonly=True)
+    date = fields.Date(string='Date', required=True, readonly=True)
+    move_count = fields.Integer(string='# Draft Entries', readonly=True)
+
+    def init(self):
+        # the rows are deltas, several rows per company and day
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS branch_draft_move_daily_count_company_date_idx
+            ON branch_draft_move_daily_count (company_id, date)
+        """)
+        self._cr.execute("SELECT 1 FROM branch_draft_move_daily_count LIMIT 1")
+        if not self._cr.fetchone():
+            self._rebuild()
+
+    @api.model
+    def _apply_moves(self, move_ids, sign=1):
+        """ Add (sign=1) or remove (sign=-1) the given account.move ids, if they are drafts. The moves must be
+        flushed to the database beforehand.
+        """
+        if not move_ids:
+            return
+        self._cr.execute("""
+            INSERT INTO branch_draft_move_daily_count (company_id, date, move_count)
+            SELECT move.company_id, move.date, %(sign)s * COUNT(*)
+            FROM account_move move
+            WHERE move.id IN %(move_ids)s AND move.state = 'draft'
+            GROUP BY move.company_id, move.date
+        """, {'sign': sign, 'move_ids': tuple(move_ids)})
+        self.invalidate_cache()
+
+    @api.model
+    def _compact(self):
+        """ Merge the deltas of every company and day in a single row, removing the days without draft entries. The
+        rows inserted by concurrent transactions are not visible to the statement and are left for the next run.
+        """
+        self._cr.execute("""
+            WITH compacted AS (
+                DELETE FROM branch_draft_move_daily_count
+                WHERE (company_id, date) IN (
+                    SELECT company_id, date FROM branch_draft_move_daily_count
+                    GROUP BY company_id, date HAVING COUNT(*) > 1 OR SUM(move_count) <= 0
+                )
+                RETURNING company_id, date, move_count
+            )
+            INSERT INTO branch_draft_move_daily_count (company_id, date, move_count)
+            SELECT company_id, date, SUM(move_count) FROM compacted
+            GROUP BY company_id, date HAVING SUM(move_count) > 0
+        """)
+        self.invalidate_cache()
+
+    @api.model
+    def _rebuild(self):
+        """ Recompute the counts from account_move. """
+        self.env['account.move'].flush(self._KEY_FIELDS)
+        self._cr.execute("DELETE FROM branch_draft_move_daily_count")
+        self._cr.execute("""
+            INSERT INTO branch_draft_move_daily_count (company_id, date, move_count)
+            SELECT move.company_id, move.date, COUNT(*)
+            FROM account_move move
+            WHERE move.state = 'draft'
+            GROUP BY move.company_id, move.date
+        """)
+        self.invalidate_cache()
+
+    @api.model
+    def _has_draft_moves(self, company_ids, date_to):
+        """ Whether the given companies have draft entries dated up to date_to. """
+        self._cr.execute("""
+            SELECT 1 FROM branch_draft_move_daily_count
+            WHERE company_id IN %s AND date <= %s
+            GROUP BY company_id, date
+            HAVING SUM(move_count) > 0
+            LIMIT 1
+        """, [tuple(company_ids), date_to])
+        return bool(self._cr.fetchone())
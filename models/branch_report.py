@@ -2,27 +2,44 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 import ast
 import copy
+import hashlib
+import heapq
+import itertools
 import json
-import io
 import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
 import lxml.html
 import datetime
 import ast
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from math import copysign
 
 from dateutil.relativedelta import relativedelta
 
 from odoo.tools.misc import xlsxwriter
-from odoo import models, fields, api, _
-from odoo.tools import config, date_utils, get_lang
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+from odoo.tools import config, date_utils, float_is_zero, get_lang, ustr
+from odoo.tools.pdf import merge_pdf
 from odoo.osv import expression
 from babel.dates import get_quarter_names
 from odoo.tools.misc import formatLang, format_date
 from odoo.addons.web.controllers.main import clean_action
+from odoo.addons.base.models.res_lang import intersperse
+from odoo.addons.base.models.ir_actions_report import _get_wkhtmltopdf_bin
+
+from .branch_report_cache import BranchReportMemoryCache
 
 _logger = logging.getLogger(__name__)
 
+# generations of the search view cache, see branch.report._get_searchview_cache_generation
+SEARCHVIEW_CACHE_GENERATIONS = itertools.count()
+
 
 class BranchReportManager(models.Model):
     _name = 'branch.report.manager'
@@ -48,11 +65,98 @@ class BranchReportFootnote(models.Model):
     manager_id = fields.Many2one('branch.report.manager')
 
 
+# Types of the report cells, see branch.report._build_cell: the cells carry their raw value ('no_format') next to the
+# displayed string ('name') so the exporters write native values.
+CELL_TYPES = ('numeric', 'date', 'text', 'currency')
+
+
+class BranchAmountFormatter(object):
+    """ Monetary formatting of formatLang for one language and currency, the separators, grouping, digits and symbol
+    position being resolved once instead of at every call. See branch.report._get_amount_formatter().
+    """
+
+    def __init__(self, lang, currency):
+        # only plain values are kept: the formatters are shared by the workers' requests, see _get_amount_formatter
+        grouping, self.thousands_sep, self.decimal_point = lang._data_get(monetary=True)
+        self.grouping = ast.literal_eval(grouping)
+        self.rounding = currency.rounding
+        self.pattern = '%%.%sf' % currency.decimal_places
+        self.prefix = self.suffix = ''
+        if currency.symbol:
+            if currency.position == 'after':
+                self.suffix = '\N{NO-BREAK SPACE}' + currency.symbol
+            else:
+                self.prefix = currency.symbol + '\N{NO-BREAK SPACE}'
+
+    def is_zero(self, amount):
+        return float_is_zero(amount, precision_rounding=self.rounding)
+
+    def format(self, amount, blank_if_zero=False):
+        if self.is_zero(amount):
+            if blank_if_zero:
+                return ''
+            # don't print -0.0 in reports
+            amount = abs(amount)
+        integer_part, __, decimal_part = (self.pattern % amount).partition('.')
+        formatted = intersperse(integer_part, self.grouping, self.thousands_sep)[0]
+        if decimal_part:
+            formatted += self.decimal_point + decimal_part
+        return self.prefix + formatted + self.suffix
+
+    def format_column(self, amounts, blank_if_zero=False):
+        """ Format a whole column of amounts at once. """
+        format_amount = self.format
+        return [format_amount(amount, blank_if_zero=blank_if_zero) for amount in amounts]
+
+
+class BranchReportContext(object):
+    """ Lookups shared by the steps of one report call (options, html, search view, footnotes), done once.
+
+    Built by branch.report._get_report_context() at the start of the call and passed down to the methods it calls
+    (report_context parameter), it never outlives the call.
+    """
+
+    def __init__(self, report):
+        self.report = report
+        self._managers = {}
+
+    @tools.lazy_property
+    def company(self):
+        return self.report.env.company
+
+    @tools.lazy_property
+    def currency(self):
+        return self.company.currency_id
+
+    @tools.lazy_property
+    def lang(self):
+        return get_lang(self.report.env)
+
+    @tools.lazy_property
+    def templates(self):
+        return self.report._get_templates()
+
+    def get_report_manager(self, multi_company):
+        if multi_company not in self._managers:
+            self._managers[multi_company] = self.report._find_report_manager(multi_company)
+        return self._managers[multi_company]
+
+
 class AccountReport(models.AbstractModel):
     _name = 'branch.report'
     _description = 'Account Report'
 
     MAX_LINES = 80
+    # size of the chunks the exported files are streamed by
+    FILE_CHUNK_SIZE = 64 * 1024
+    # number of lines per document converted by wkhtmltopdf, and number of conversions run at the same time
+    PDF_CHUNK_LINES = 5000
+    PDF_WORKERS = 4
+    # options that have no impact on the search view, see _get_searchview_html
+    SEARCHVIEW_IGNORED_OPTIONS = ('headers', 'unfolded_lines', 'selected_column', 'top_lines', 'lines_offset',
+                                  'lines_progress', 'lines_remaining')
+    # process-wide LRU of the rendered search views, kept apart from the ormcache
+    SEARCHVIEW_CACHE = BranchReportMemoryCache(4 * 1024 * 1024)
     filter_multi_company = True
     filter_date = None
     filter_all_entries = None
@@ -68,22 +172,42 @@ class AccountReport(models.AbstractModel):
     # OPTIONS: journals
     ####################################################
 
+    @api.model
+    def _get_filter_companies_key(self):
+        """ Companies the journal filter depends on: the ones of the user and the active ones. """
+        return tuple(self.env.user.company_ids.ids or [self.env.company.id]), tuple(self.env.companies.ids)
+
     @api.model
     def _get_filter_journals(self):
-        return self.env['account.journal'].with_context(active_test=False).search([
-            ('company_id', 'in', self.env.user.company_ids.ids or [self.env.company.id])
-        ], order="company_id, name")
+        journal_ids = self._get_filter_journal_ids(self._get_filter_companies_key())
+        return self.env['account.journal'].with_context(active_test=False).browse(journal_ids)
+
+    @api.model
+    @tools.ormcache('self.env.uid', 'companies_key')
+    def _get_filter_journal_ids(self, companies_key):
+        return tuple(self.env['account.journal'].with_context(active_test=False).search([
+            ('company_id', 'in', list(companies_key[0]))
+        ], order="company_id, name").ids)
 
     @api.model
     def _get_filter_journal_groups(self):
+        group_data = self._get_filter_journal_group_data(self._get_filter_companies_key(), self.env.lang)
+        return self.env['account.journal.group'].browse([group_id for group_id, __, __ in group_data])
+
+    @api.model
+    @tools.ormcache('self.env.uid', 'companies_key', 'lang')
+    def _get_filter_journal_group_data(self, companies_key, lang):
+        """ Return a tuple of (group_id, group_name, journal_ids) of the journal groups to display, journal_ids being
+        the journals of the filter not excluded by the group.
+        """
         journals = self._get_filter_journals()
-        groups = self.env['account.journal.group'].search([], order='sequence')
-        ret = self.env['account.journal.group']
-        for journal_group in groups:
+        group_data = []
+        for journal_group in self.env['account.journal.group'].search([], order='sequence'):
             # Only display the group if it doesn't exclude every journal
-            if journals - journal_group.excluded_journal_ids:
-                ret += journal_group
-        return ret
+            journal_ids = (journals - journal_group.excluded_journal_ids).ids
+            if journal_ids:
+                group_data.append((journal_group.id, journal_group.name, tuple(journal_ids)))
+        return tuple(group_data)
 
     @api.model
     def _init_filter_journals(self, options, previous_options=None):
@@ -100,14 +224,13 @@ class AccountReport(models.AbstractModel):
 
         group_header_displayed = False
         default_group_ids = []
-        for group in self._get_filter_journal_groups():
-            journal_ids = (self._get_filter_journals() - group.excluded_journal_ids).ids
-            if len(journal_ids):
-                if not group_header_displayed:
-                    group_header_displayed = True
-                    options['journals'].append({'id': 'divider', 'name': _('Journal Groups')})
-                    default_group_ids = journal_ids
-                options['journals'].append({'id': 'group', 'name': group.name, 'ids': journal_ids})
+        for __, group_name, journal_ids in self._get_filter_journal_group_data(self._get_filter_companies_key(),
+                                                                                self.env.lang):
+            if not group_header_displayed:
+                group_header_displayed = True
+                options['journals'].append({'id': 'divider', 'name': _('Journal Groups')})
+                default_group_ids = list(journal_ids)
+            options['journals'].append({'id': 'group', 'name': group_name, 'ids': list(journal_ids)})
 
         for j in self._get_filter_journals():
             if j.company_id != previous_company:
@@ -456,19 +579,20 @@ class AccountReport(models.AbstractModel):
         if not enable_analytic_accounts and not enable_analytic_tags:
             return
 
+        previous_analytic_accounts = (previous_options or {}).get('analytic_accounts', [])
+        analytic_account_ids = [int(x) for x in previous_analytic_accounts] if enable_analytic_accounts else []
+        previous_analytic_tags = (previous_options or {}).get('analytic_tags', [])
+        analytic_tag_ids = [int(x) for x in previous_analytic_tags] if enable_analytic_tags else []
+        names = self._get_records_names({'res.branch': analytic_account_ids, 'branch.analytic.tag': analytic_tag_ids})
+
         if enable_analytic_accounts:
-            previous_analytic_accounts = (previous_options or {}).get('analytic_accounts', [])
-            analytic_account_ids = [int(x) for x in previous_analytic_accounts]
-            selected_analytic_accounts = self.env['res.branch'].search([('id', 'in', analytic_account_ids)])
-            options['analytic_accounts'] = selected_analytic_accounts.ids
-            options['selected_analytic_account_names'] = selected_analytic_accounts.mapped('name')
+            # the records not found anymore are removed from the options
+            options['analytic_accounts'] = [x for x in analytic_account_ids if x in names['res.branch']]
+            options['selected_analytic_account_names'] = [names['res.branch'][x] for x in options['analytic_accounts']]
 
         if enable_analytic_tags:
-            previous_analytic_tags = (previous_options or {}).get('analytic_tags', [])
-            analytic_tag_ids = [int(x) for x in previous_analytic_tags]
-            selected_analytic_tags = self.env['branch.analytic.tag'].search([('id', 'in', analytic_tag_ids)])
-            options['analytic_tags'] = selected_analytic_tags.ids
-            options['selected_analytic_tag_names'] = selected_analytic_tags.mapped('name')
+            options['analytic_tags'] = [x for x in analytic_tag_ids if x in names['branch.analytic.tag']]
+            options['selected_analytic_tag_names'] = [names['branch.analytic.tag'][x] for x in options['analytic_tags']]
 
     @api.model
     def _get_options_analytic_domain(self, options):
@@ -493,14 +617,7 @@ class AccountReport(models.AbstractModel):
         options['partner'] = True
         options['partner_ids'] = previous_options and previous_options.get('partner_ids') or []
         options['partner_categories'] = previous_options and previous_options.get('partner_categories') or []
-        selected_partner_ids = [int(partner) for partner in options['partner_ids']]
-        selected_partners = selected_partner_ids and self.env['res.partner'].browse(selected_partner_ids) or self.env[
-            'res.partner']
-        options['selected_partner_ids'] = selected_partners.mapped('name')
-        selected_partner_category_ids = [int(category) for category in options['partner_categories']]
-        selected_partner_categories = selected_partner_category_ids and self.env['res.partner.category'].browse(
-            selected_partner_category_ids) or self.env['res.partner.category']
-        options['selected_partner_categories'] = selected_partner_categories.mapped('name')
+        self._set_options_selected_names(options)
 
     @api.model
     def _get_options_partner_domain(self, options):
@@ -513,6 +630,58 @@ class AccountReport(models.AbstractModel):
             domain.append(('partner_id.category_id', 'in', partner_category_ids))
         return domain
 
+    ####################################################
+    # OPTIONS: names
+    ####################################################
+
+    _RECORDS_NAMES_KEY = 'pcp_acc_nassag.records_names'
+
+    @api.model
+    def _get_records_names(self, ids_by_model):
+        """ Read the names of the records referenced by the options, with one query per model, memoized for the rest
+        of the transaction.
+
+        :param ids_by_model:    A dictionary {model_name: ids}.
+        :return:                A dictionary {model_name: {id: name}}, the records not found being missing.
+        """
+        records_names = self.env.cr.cache.setdefault(self._RECORDS_NAMES_KEY, {})
+        result = {}
+        for model_name, ids in ids_by_model.items():
+            names = records_names.setdefault((model_name, self.env.uid, self.env.lang), {})
+            missing_ids = [record_id for record_id in set(int(x) for x in ids) if record_id not in names]
+            if missing_ids:
+                for vals in self.env[model_name].with_context(active_test=False).search_read(
+                        [('id', 'in', missing_ids)], ['name']):
+                    names[vals['id']] = vals['name']
+            result[model_name] = names
+        return result
+
+    @api.model
+    def _get_options_names_descriptors(self, options):
+        """ Return a list of (ids key, model name, names key): the names of the records whose ids are in
+        options[ids key] are displayed from options[names key].
+        """
+        descriptors = []
+        if options.get('analytic_accounts') is not None:
+            descriptors.append(('analytic_accounts', 'res.branch', 'selected_analytic_account_names'))
+        if options.get('analytic_tags') is not None:
+            descriptors.append(('analytic_tags', 'branch.analytic.tag', 'selected_analytic_tag_names'))
+        if options.get('partner'):
+            descriptors.append(('partner_ids', 'res.partner', 'selected_partner_ids'))
+            descriptors.append(('partner_categories', 'res.partner.category', 'selected_partner_categories'))
+        return descriptors
+
+    @api.model
+    def _set_options_selected_names(self, options):
+        descriptors = self._get_options_names_descriptors(options)
+        ids_by_model = defaultdict(list)
+        for ids_key, model_name, __ in descriptors:
+            ids_by_model[model_name] += options.get(ids_key) or []
+        names = self._get_records_names(ids_by_model)
+        for ids_key, model_name, names_key in descriptors:
+            options[names_key] = [names[model_name][int(x)] for x in options.get(ids_key) or []
+                                  if int(x) in names[model_name]]
+
     ####################################################
     # OPTIONS: all_entries
     ####################################################
@@ -533,6 +702,8 @@ class AccountReport(models.AbstractModel):
         if self.order_selected_column is not None:
             options['selected_column'] = previous_options and previous_options.get('selected_column') or \
                                          self.order_selected_column['default']
+            # only keep the first top_lines sorted lines of each parent (top-N), all of them when not set
+            options['top_lines'] = previous_options and previous_options.get('top_lines') or None
 
     ####################################################
     # OPTIONS: hierarchy
@@ -541,25 +712,54 @@ class AccountReport(models.AbstractModel):
     @api.model
     def _init_filter_hierarchy(self, options, previous_options=None):
         # Only propose the option if there are groups
-        if self.filter_hierarchy is not None and self.env['account.group'].search(
-                [('company_id', 'in', self.env.companies.ids)], limit=1):
+        if self.filter_hierarchy is not None and self._has_account_groups(tuple(self.env.companies.ids)):
             if previous_options and 'hierarchy' in previous_options:
                 options['hierarchy'] = previous_options['hierarchy']
             else:
                 options['hierarchy'] = self.filter_hierarchy
 
+    @api.model
+    @tools.ormcache('self.env.uid', 'company_ids')
+    def _has_account_groups(self, company_ids):
+        return bool(self.env['account.group'].search([('company_id', 'in', list(company_ids))], limit=1))
+
     # Create codes path in the hierarchy based on account.
     def get_account_codes(self, account):
         # A code is tuple(id, name)
-        codes = []
-        if account.group_id:
-            group = account.group_id
-            while group:
-                codes.append((group.id, group.display_name))
-                group = group.parent_id
-        else:
-            codes.append((0, _('(No Group)')))
-        return list(reversed(codes))
+        return self._get_account_codes_map(account.ids).get(account.id, [(0, _('(No Group)'))])
+
+    @api.model
+    def _get_account_codes_map(self, account_ids):
+        """ Same as get_account_codes for all the given accounts at once: {account_id: codes}, the accounts not found
+        being missing.
+        """
+        self.env['account.account'].flush(['company_id', 'group_id'])
+        self._cr.execute("SELECT id, company_id, group_id FROM account_account WHERE id IN %s",
+                         [tuple(account_ids) or (0,)])
+        codes_map = {}
+        for account_id, company_id, group_id in self._cr.fetchall():
+            if group_id:
+                codes_map[account_id] = list(self._get_group_codes_map(company_id, self.env.lang)[group_id])
+            else:
+                codes_map[account_id] = [(0, _('(No Group)'))]
+        return codes_map
+
+    @api.model
+    @tools.ormcache('company_id', 'lang')
+    def _get_group_codes_map(self, company_id, lang):
+        """ Return a dictionary {group_id: codes} giving the path of every account.group of the company, from the
+        root group to the group itself, a code being a tuple (group_id, group_display_name).
+        """
+        groups = self.env['account.group'].sudo().with_context(lang=lang).search([('company_id', '=', company_id)])
+        groups.flush(['parent_path'])
+        names = dict(groups.name_get())
+        return {
+            group.id: tuple((int(path_id), names[int(path_id)]) for path_id in group.parent_path.strip('/').split('/'))
+            for group in groups
+        }
+
+    def _get_hierarchy_account_id(self, line):
+        return line.get('account_id', self._get_caret_option_target_id(line.get('id')))
 
     @api.model
     def _create_hierarchy(self, lines, options):
@@ -577,6 +777,7 @@ class AccountReport(models.AbstractModel):
         def add_to_hierarchy(lines, key, level, parent_id, hierarchy):
             val_dict = hierarchy[key]
             unfolded = val_dict['id'] in options.get('unfolded_lines') or unfold_all
+            formatted_totals = iter(self.format_values([c for c in val_dict['totals'] if isinstance(c, (int, float))]))
             # add the group totals
             lines.append({
                 'id': val_dict['id'],
@@ -586,7 +787,8 @@ class AccountReport(models.AbstractModel):
                 'unfolded': unfolded,
                 'level': level,
                 'parent_id': parent_id,
-                'columns': [{'name': self.format_value(c) if isinstance(c, (int, float)) else c, 'no_format_name': c}
+                'columns': [{'name': next(formatted_totals), 'no_format_name': c, 'no_format': c, 'type': 'currency'}
+                            if isinstance(c, (int, float)) else {'name': c, 'no_format_name': c}
                             for c in val_dict['totals']],
                 'name_class': 'o_branch_report_name_ellipsis top-vertical-align'
             })
@@ -606,9 +808,7 @@ class AccountReport(models.AbstractModel):
                 lambda: {'totals': [None] * len(lines[0]['columns']), 'lines': [], 'children_codes': set(), 'name': '',
                          'parent_id': None, 'id': ''})
             for line in lines:
-                account = self.env['account.account'].browse(
-                    line.get('account_id', self._get_caret_option_target_id(line.get('id'))))
-                codes = self.get_account_codes(account)  # id, name
+                codes = account_codes_map.get(self._get_hierarchy_account_id(line), no_group_codes)  # id, name
                 for code in codes:
                     hierarchy[code[0]]['id'] = 'hierarchy_' + str(code[0])
                     hierarchy[code[0]]['name'] = code[1]
@@ -634,6 +834,13 @@ class AccountReport(models.AbstractModel):
                 add_to_hierarchy(hierarchy_lines, root, level, parent_id, hierarchy)
             return hierarchy_lines
 
+        # the group paths of all the accounts of the report are loaded at once
+        account_codes_map = self._get_account_codes_map([
+            self._get_hierarchy_account_id(line) for line in lines
+            if line.get('caret_options') == 'account.account' or line.get('account_id')
+        ])
+        no_group_codes = [(0, _('(No Group)'))]
+
         new_lines = []
         account_lines = []
         current_level = 0
@@ -688,13 +895,7 @@ class AccountReport(models.AbstractModel):
         if self.filter_analytic:
             options['analytic'] = self.filter_analytic
 
-        filter_list = [attr
-                       for attr in dir(self)
-                       if (attr.startswith('filter_') or attr.startswith('order_'))
-                       and attr not in ('filter_date', 'filter_comparison', 'filter_multi_company')
-                       and len(attr) > 7
-                       and not callable(getattr(self, attr))]
-        for filter_key in filter_list:
+        for filter_key in self._get_filter_descriptors():
             options_key = filter_key[7:]
             init_func = getattr(self, '_init_%s' % filter_key, None)
             if init_func:
@@ -708,6 +909,17 @@ class AccountReport(models.AbstractModel):
                         options[options_key] = filter_opt
         return options
 
+    @api.model
+    @tools.ormcache()
+    def _get_filter_descriptors(self):
+        """ Names of the filter_*/order_* attributes of the report class, initialized by _get_options. """
+        return tuple(attr
+                     for attr in dir(self)
+                     if (attr.startswith('filter_') or attr.startswith('order_'))
+                     and attr not in ('filter_date', 'filter_comparison', 'filter_multi_company')
+                     and len(attr) > 7
+                     and not callable(getattr(self, attr)))
+
     @api.model
     def _get_options_domain(self, options):
         domain = [
@@ -779,6 +991,104 @@ class AccountReport(models.AbstractModel):
     def _get_table(self, options):
         return self.get_header(options), self._get_lines(options)
 
+    def _build_cell(self, value, cell_type='text', name=None, currency=False, **values):
+        """ Return a cell of a report line holding the raw value of the given type (see CELL_TYPES) and the string
+        displayed for it.
+
+        :param name:        The displayed string, computed from the value when not given (amounts formatted in batch
+                            with format_values, ...).
+        :param currency:    The res.currency of a 'currency' cell, the one of the company by default.
+        :param values:      Other keys of the cell (class, style, ...).
+        """
+        if cell_type == 'date':
+            # the raw values must survive the JSON round trip of the report cache
+            value = value and fields.Date.to_string(value)
+        if name is None:
+            if value is None or value is False:
+                name = ''
+            elif cell_type == 'currency':
+                name = self.format_value(value, currency=currency)
+            elif cell_type == 'numeric':
+                name = formatLang(self.env, value)
+            elif cell_type == 'date':
+                name = format_date(self.env, value)
+            else:
+                name = value
+        return dict(values, name=name, no_format=value, type=cell_type)
+
+    ####################################################
+    # PAGINATION
+    ####################################################
+
+    def _get_lines_page_size(self, options):
+        """ Maximum number of lines rendered under an unfolded parent at once, None to render them all. """
+        return None if self.env.context.get('print_mode') else self.MAX_LINES
+
+    def _get_lines_window(self, options):
+        """ Position sent back by the 'load more' line of the previous page: (offset, progress, remaining), the
+        progress being the running balance of the lines already rendered.
+        """
+        return (
+            int(options.get('lines_offset') or 0),
+            float(options.get('lines_progress') or 0.0),
+            int(options.get('lines_remaining') or 0),
+        )
+
+    def _get_load_more_line(self, options, parent_id, offset, progress, remaining):
+        return {
+            'id': 'loadmore_%s' % (parent_id or ''),
+            'offset': offset,
+            'progress': progress,
+            'remaining': remaining,
+            'class': 'o_account_reports_load_more text-center',
+            'parent_id': parent_id,
+            'name': _('Load more... (%s remaining)') % remaining,
+            'colspan': len(self._get_columns_name(options)),
+            'columns': [],
+        }
+
+    ####################################################
+    # CACHE
+    ####################################################
+
+    def _get_cache_companies(self, options):
+        return self.env.companies.ids if options.get('multi_company') else self.env.company.ids
+
+    def _get_cache_key(self, method, options, line_id=None):
+        """ Key of a _get_table/_get_lines result: report, normalized options, companies, language, user, the context
+        values changing the lines, the date the amounts are converted at and the version stamp of the data of these
+        companies up to the end of the period (the currency rates included).
+        """
+        company_ids = self._get_cache_companies(options)
+        date_to = options.get('date') and (options['date'].get('date_to') or options['date'].get('date'))
+        normalized_options = {k: v for k, v in options.items() if k not in ('headers', 'unposted_in_period')}
+        return self.env['branch.report.cache']._make_key({
+            'report': self._name,
+            'report_id': self.id,
+            # the balances in foreign currencies are converted at the rates of the day
+            'conversion_date': fields.Date.to_string(fields.Date.today()),
+            'method': method,
+            'line_id': line_id,
+            'options': normalized_options,
+            'companies': company_ids,
+            'lang': self.env.context.get('lang'),
+            'allowed_company_ids': self.env.context.get('allowed_company_ids'),
+            'uid': self.env.uid,
+            # the other values of the context are set from the options (see _set_context) or only used by the client
+            'print_mode': bool(self.env.context.get('print_mode')),
+            'no_format': bool(self.env.context.get('no_format')),
+            'data_version': self.env['branch.report.cache']._get_data_version(company_ids, date_to),
+        })
+
+    def _get_table_with_cache(self, options):
+        key = self._get_cache_key('_get_table', options)
+        headers, lines = self.env['branch.report.cache']._get_or_compute(key, lambda: self._get_table(options))
+        return headers, lines
+
+    def _get_lines_with_cache(self, options, line_id=None):
+        key = self._get_cache_key('_get_lines', options, line_id=line_id)
+        return self.env['branch.report.cache']._get_or_compute(key, lambda: self._get_lines(options, line_id=line_id))
+
     # TO BE OVERWRITTEN
     def _get_templates(self):
         return {
@@ -1056,7 +1366,7 @@ class AccountReport(models.AbstractModel):
         return inv_values
 
     @api.model
-    def _sort_lines(self, lines, options):
+    def _sort_lines(self, lines, options, limit=None):
         ''' Sort report lines based on the 'selected_column' key inside the options.
         The value of options['selected_column'] is an integer, positive or negative, indicating on which column
         to sort and also if it must be an ascending sort (positive value) or a descending sort (negative value).
@@ -1099,30 +1409,67 @@ class AccountReport(models.AbstractModel):
 
         :param lines:   The report lines.
         :param options: The report options.
+        :param limit:   If set, only the first limit sorted lines of each parent are kept (top-N), the others being
+                        discarded.
         :return:        Lines sorted by the selected column.
         '''
 
-        def merge_tree(line):
-            sorted_list.append(line)
-            for l in sorted(tree[line['id']],
-                            key=lambda k: selected_sign * k['columns'][selected_column - k.get('colspan', 1)][
-                                'no_format']):
-                merge_tree(l)
-
-        sorted_list = []
         selected_column = abs(options['selected_column']) - 1
         selected_sign = -copysign(1, options['selected_column'])
-        tree = defaultdict(list)
         if 'sortable' not in self._get_columns_name(options)[selected_column].get('class', ''):
             return lines  # Nothing to do here
+
+        def sort_key(line):
+            return selected_sign * line['columns'][selected_column - line.get('colspan', 1)]['no_format']
+
+        def is_sortable(line):
+            # the total lines and the lines without value (e.g. 'load more') stay after the sorted ones
+            columns = line.get('columns') or []
+            cell_index = selected_column - line.get('colspan', 1)
+            return 'total' not in line.get('class', '') and 0 <= cell_index < len(columns) \
+                and 'no_format' in columns[cell_index]
+
+        def sort_children(parent_id):
+            children = tree.get(parent_id, [])
+            sortable_children = [line for line in children if is_sortable(line)]
+            if limit:
+                sortable_children = heapq.nsmallest(limit, sortable_children, key=sort_key)
+            else:
+                sortable_children.sort(key=sort_key)
+            return sortable_children + [line for line in children if not is_sortable(line)]
+
+        tree = defaultdict(list)
         for line in lines:
             tree[line.get('parent_id') or None].append(line)
-        for line in sorted(tree[None], key=lambda k: ('total' in k.get('class', ''), selected_sign * k['columns'][
-            selected_column - k.get('colspan', 1)]['no_format'])):
-            merge_tree(line)
 
+        # depth-first walk of the tree, iterative to support any depth
+        sorted_list = []
+        stack = [iter(sort_children(None))]
+        while stack:
+            line = next(stack[-1], None)
+            if line is None:
+                stack.pop()
+                continue
+            sorted_list.append(line)
+            if line['id'] in tree:
+                stack.append(iter(sort_children(line['id'])))
         return sorted_list
 
+    @api.model
+    def _get_order_by_selected_column(self, options, column_fields):
+        """ ORDER BY clause sorting the records like options['selected_column'], for the reports able to sort their
+        lines in their queries (and then to only fetch the first ones).
+
+        :param options:         The report options.
+        :param column_fields:   A dictionary {column number (starting at 1): field to order by}.
+        :return:                An ORDER BY clause, or None if the lines are not sorted on one of these columns.
+        """
+        selected_column = options.get('selected_column')
+        if not selected_column or abs(selected_column) not in column_fields:
+            return None
+        # consistent with _sort_lines: a positive selected_column sorts the lines by decreasing values
+        return '%s %s' % (column_fields[abs(selected_column)], 'DESC' if selected_column > 0 else 'ASC')
+
     def _set_context(self, options):
         """This method will set information inside the context based on the options dict as some options need to be in context for the query_get method defined in account_move_line"""
         ctx = self.env.context.copy()
@@ -1161,66 +1508,116 @@ class AccountReport(models.AbstractModel):
         return a dictionary of informations that will be needed by the js widget, manager_id, footnotes, html of report and searchview, ...
         '''
         options = self._get_options(options)
+        report_context = self._get_report_context()
 
-        searchview_dict = {'options': options, 'context': self.env.context}
-        # Check if report needs analytic
-        if options.get('analytic_accounts') is not None:
-            options['selected_analytic_account_names'] = [self.env['res.branch'].browse(int(account)).name for account
-                                                          in options['analytic_accounts']]
-        if options.get('analytic_tags') is not None:
-            options['selected_analytic_tag_names'] = [self.env['branch.analytic.tag'].browse(int(tag)).name for tag in
-                                                      options['analytic_tags']]
-        if options.get('partner'):
-            options['selected_partner_ids'] = [self.env['res.partner'].browse(int(partner)).name for partner in
-                                               options['partner_ids']]
-            options['selected_partner_categories'] = [self.env['res.partner.category'].browse(int(category)).name for
-                                                      category in (options.get('partner_categories') or [])]
+        # Display the names of the selected analytic accounts/tags, partners and partner categories
+        self._set_options_selected_names(options)
 
         # Check whether there are unposted entries for the selected period or not (if the report allows it)
         if options.get('date') and options.get('all_entries') is not None:
             date_to = options['date'].get('date_to') or options['date'].get('date') or fields.Date.today()
-            period_domain = [('state', '=', 'draft'), ('date', '<=', date_to)]
-            options['unposted_in_period'] = bool(self.env['account.move'].search_count(period_domain))
+            options['unposted_in_period'] = self.env['branch.draft.move.daily.count']._has_draft_moves(
+                self.env.companies.ids, date_to)
 
         if options.get('journals'):
             journals_selected = set(journal['id'] for journal in options['journals'] if journal.get('selected'))
-            for journal_group in self.env['account.journal.group'].search([('company_id', '=', self.env.company.id)]):
-                if journals_selected and journals_selected == set(self._get_filter_journals().ids) - set(
+            filter_journal_ids = set(self._get_filter_journals().ids)
+            for journal_group in self.env['account.journal.group'].search(
+                    [('company_id', '=', report_context.company.id)]):
+                if journals_selected and journals_selected == filter_journal_ids - set(
                         journal_group.excluded_journal_ids.ids):
                     options['name_journal_group'] = journal_group.name
                     break
 
-        report_manager = self._get_report_manager(options)
+        report_manager = self._get_report_manager(options, report_context=report_context)
         info = {'options': options,
                 'context': self.env.context,
                 'report_manager_id': report_manager.id,
                 'footnotes': [{'id': f.id, 'line': f.line, 'text': f.text} for f in report_manager.footnotes_ids],
                 'buttons': self._get_reports_buttons_in_sequence(),
-                'main_html': self.get_html(options),
-                'searchview_html': self.env['ir.ui.view']._render_template(
-                    self._get_templates().get('search_template', 'account_reports.search_template'),
-                    values=searchview_dict),
+                'main_html': self.get_html(options, report_context=report_context),
+                'searchview_html': self._get_searchview_html(options, report_context=report_context),
                 }
         return info
 
-    def get_html(self, options, line_id=None, additional_context=None):
+    def _get_searchview_html(self, options, report_context=None):
+        """ Html of the search view, only rendered again when the filters or the context change (not when the lines
+        are unfolded, sorted or paginated).
+        """
+        report_context = report_context or self._get_report_context()
+        template = report_context.templates.get('search_template', 'account_reports.search_template')
+        searchview_options = {
+            key: value for key, value in options.items() if key not in self.SEARCHVIEW_IGNORED_OPTIONS
+        }
+        key = hashlib.sha1(json.dumps([
+            self.env.cr.dbname,
+            self._get_searchview_cache_generation(),
+            self.env.uid,
+            template,
+            searchview_options,
+            # the template is rendered with the context (allowed companies, ...)
+            self.env.context,
+        ], sort_keys=True, default=str).encode()).hexdigest()
+        html = self.SEARCHVIEW_CACHE.get(key)
+        if html is None:
+            html = self.env['ir.ui.view']._render_template(
+                template, values={'options': searchview_options, 'context': self.env.context})
+            self.SEARCHVIEW_CACHE.set(key, html)
+        return html
+
+    @api.model
+    @tools.ormcache()
+    def _get_searchview_cache_generation(self):
+        # cleared with the ormcache, e.g. when a view is written: the search views cached before are not looked up
+        # anymore and are evicted by the newer ones
+        return next(SEARCHVIEW_CACHE_GENERATIONS)
+
+    def get_html(self, options, line_id=None, additional_context=None, table=None, report_context=None):
         '''
         return the html value of report, or html value of unfolded line
         * if line_id is set, the template used will be the line_template
         otherwise it uses the main_template. Reason is for efficiency, when unfolding a line in the report
         we don't want to reload all lines, just get the one we unfolded.
+        * if table is set (see _get_export_table), it is rendered instead of computing the report again.
         '''
         # Prevent inconsistency between options and context.
         self = self.with_context(self._set_context(options))
 
-        templates = self._get_templates()
-        report_manager = self._get_report_manager(options)
+        template, render_values, footnotes_to_render = self._get_html_render_values(
+            options, line_id=line_id, additional_context=additional_context, table=table,
+            report_context=report_context)
+        return self._render_html(template, render_values, footnotes_to_render, report_context=report_context)
+
+    def _get_html_chunks(self, options, chunk_size, table=None):
+        """ Render the report with the main template once per chunk of chunk_size lines, the footnotes being
+        appended to the last chunk. Used to print very large reports, see get_pdf.
+        """
+        self = self.with_context(self._set_context(options))
+
+        report_context = self._get_report_context()
+        template, render_values, footnotes_to_render = self._get_html_render_values(
+            options, table=table, report_context=report_context)
+        lines = render_values['lines']['lines']
+        chunks = []
+        for start in range(0, len(lines) or 1, chunk_size):
+            chunk_values = dict(render_values, lines=dict(render_values['lines'], lines=lines[start:start + chunk_size]))
+            is_last_chunk = start + chunk_size >= len(lines)
+            chunks.append(self._render_html(template, chunk_values, footnotes_to_render if is_last_chunk else [],
+                                            report_context=report_context))
+        return chunks
+
+    def _get_html_render_values(self, options, line_id=None, additional_context=None, table=None,
+                                report_context=None):
+        """ Return the template to render, its values and the footnotes to append, see get_html. """
+        report_context = report_context or self._get_report_context()
+        templates = report_context.templates
+        report_manager = self._get_report_manager(options, report_context=report_context)
 
         render_values = {
             'report': {
                 'name': self._get_report_name(),
                 'summary': report_manager.summary,
-                'company_name': self.env.company.name,
+                'company_name': report_context.company.name,
             },
             'options': options,
             'context': self.env.context,
@@ -1232,16 +1629,20 @@ class AccountReport(models.AbstractModel):
         # Create lines/headers.
         if line_id:
             headers = options['headers']
-            lines = self._get_lines(options, line_id=line_id)
+            lines = self._get_lines_with_cache(options, line_id=line_id)
             template = templates['line_template']
         else:
-            headers, lines = self._get_table(options)
+            if table is not None:
+                # the export table is shared by the renderers, the lines are changed below (hierarchy, footnotes)
+                headers, lines = table[0], [dict(line) for line in table[1]]
+            else:
+                headers, lines = self._get_table_with_cache(options)
             options['headers'] = headers
             template = templates['main_template']
         if options.get('hierarchy'):
             lines = self._create_hierarchy(lines, options)
         if options.get('selected_column'):
-            lines = self._sort_lines(lines, options)
+            lines = self._sort_lines(lines, options, limit=options.get('top_lines'))
         render_values['lines'] = {'columns_header': headers, 'lines': lines}
 
         # Manage footnotes.
@@ -1257,19 +1658,22 @@ class AccountReport(models.AbstractModel):
                     number += 1
                     line['footnote'] = str(number)
                     footnotes_to_render.append({'id': f.id, 'number': number, 'text': f.text})
+        return template, render_values, footnotes_to_render
 
-        # Render.
+    def _render_html(self, template, render_values, footnotes_to_render, report_context=None):
         html = self.env.ref(template)._render(render_values)
         if self.env.context.get('print_mode', False):
-            for k, v in self._replace_class().items():
-                html = html.replace(k, v)
-            # append footnote as well
-            html = html.replace(b'<div class="js_branch_report_footnotes"></div>',
-                                self.get_html_footnotes(footnotes_to_render))
+            # replace the classes and append the footnotes in a single pass over the html
+            replacements = dict(self._replace_class())
+            replacements[b'<div class="js_branch_report_footnotes"></div>'] = self.get_html_footnotes(
+                footnotes_to_render, report_context=report_context)
+            pattern = re.compile(b'|'.join(re.escape(key) for key in sorted(replacements, key=len, reverse=True)))
+            html = pattern.sub(lambda match: replacements[match.group(0)], html)
         return html
 
-    def get_html_footnotes(self, footnotes):
-        template = self._get_templates().get('footnotes_template', 'account_reports.footnotes_template')
+    def get_html_footnotes(self, footnotes, report_context=None):
+        report_context = report_context or self._get_report_context()
+        template = report_context.templates.get('footnotes_template', 'account_reports.footnotes_template')
         rcontext = {'footnotes': footnotes, 'context': self.env.context}
         html = self.env['ir.ui.view']._render_template(template, values=dict(rcontext))
         return html
@@ -1322,10 +1726,17 @@ class AccountReport(models.AbstractModel):
         }
         return type_mapping.get(file_type, False)
 
-    def _get_report_manager(self, options):
+    def _get_report_context(self):
+        """ Return a new BranchReportContext, to pass down to the methods of the call. """
+        return BranchReportContext(self)
+
+    def _get_report_manager(self, options, report_context=None):
+        report_context = report_context or self._get_report_context()
+        return report_context.get_report_manager(bool(options.get('multi_company', False)))
+
+    def _find_report_manager(self, multi_company_report):
         domain = [('report_name', '=', self._name)]
         domain = (domain + [('financial_report_id', '=', self.id)]) if 'id' in dir(self) else domain
-        multi_company_report = options.get('multi_company', False)
         if not multi_company_report:
             domain += [('company_id', '=', self.env.company.id)]
         else:
@@ -1349,16 +1760,35 @@ class AccountReport(models.AbstractModel):
         :param blank_if_zero:   An optional flag forcing the string to be empty if amount is zero.
         :return:                The formatted amount as a string.
         '''
-        currency_id = currency or self.env.company.currency_id
-        if currency_id.is_zero(amount):
-            if blank_if_zero:
-                return ''
-            # don't print -0.0 in reports
-            amount = abs(amount)
-
+        formatter = self._get_amount_formatter(currency)
         if self.env.context.get('no_format'):
+            if formatter.is_zero(amount):
+                # don't print -0.0 in reports
+                return '' if blank_if_zero else abs(amount)
             return amount
-        return formatLang(self.env, amount, currency_obj=currency_id)
+        return formatter.format(amount, blank_if_zero=blank_if_zero)
+
+    @api.model
+    def format_values(self, amounts, currency=False, blank_if_zero=False):
+        """ Same as format_value for a whole column of amounts, formatted in one batch. """
+        if self.env.context.get('no_format'):
+            return [self.format_value(amount, currency=currency, blank_if_zero=blank_if_zero) for amount in amounts]
+        return self._get_amount_formatter(currency).format_column(amounts, blank_if_zero=blank_if_zero)
+
+    @api.model
+    def _get_amount_formatter(self, currency=False):
+        """ Return the BranchAmountFormatter of the language of the report and the currency (the one of the company
+        by default).
+        """
+        currency = currency or self.env.company.currency_id
+        return self._get_amount_formatter_cached(get_lang(self.env).code, currency.id)
+
+    @api.model
+    @tools.ormcache('lang_code', 'currency_id')
+    def _get_amount_formatter_cached(self, lang_code, currency_id):
+        # the languages and the currencies clear the ormcache when they are written
+        return BranchAmountFormatter(
+            self.env['res.lang']._lang_get(lang_code), self.env['res.currency'].browse(currency_id))
 
     @api.model
     def _format_aml_name(self, line_name, move_ref, move_name):
@@ -1403,7 +1833,7 @@ class AccountReport(models.AbstractModel):
         """
         return {b'o_account_reports_no_print': b'', b'table-responsive': b'', b'<a': b'<span', b'</a>': b'</span>'}
 
-    def get_pdf(self, options, minimal_layout=True):
+    def get_pdf(self, options, minimal_layout=True, table=None):
         # As the assets are generated during the same transaction as the rendering of the
         # templates calling them, there is a scenario where the assets are unreachable: when
         # you make a request to read the assets while the transaction creating them is not done.
@@ -1427,10 +1857,12 @@ class AccountReport(models.AbstractModel):
             "account_reports.print_template",
             values=dict(rcontext),
         )
-        body_html = self.with_context(print_mode=True).get_html(options)
-
-        body = body.replace(b'<body class="o_account_reports_body_print">',
-                            b'<body class="o_account_reports_body_print">' + body_html)
+        # big reports are split in chunks converted in parallel, see _run_wkhtmltopdf_parallel
+        bodies = [
+            body.replace(b'<body class="o_account_reports_body_print">',
+                         b'<body class="o_account_reports_body_print">' + body_html)
+            for body_html in self.with_context(print_mode=True)._get_html_chunks(options, self.PDF_CHUNK_LINES, table=table)
+        ]
         if minimal_layout:
             header = ''
             footer = self.env['ir.actions.report']._render_template("web.internal_layout", values=rcontext)
@@ -1471,17 +1903,62 @@ class AccountReport(models.AbstractModel):
                 footer = b''
             header = headers
 
-        landscape = False
-        if len(self.with_context(print_mode=True).get_header(options)[-1]) > 5:
-            landscape = True
+        # the headers have been computed while rendering the html
+        landscape = len(options['headers'][-1]) > 5
 
-        return self.env['ir.actions.report']._run_wkhtmltopdf(
-            [body],
+        return self._run_wkhtmltopdf_parallel(
+            bodies,
             header=header, footer=footer,
             landscape=landscape,
             specific_paperformat_args=spec_paperformat_args
         )
 
+    def _run_wkhtmltopdf_parallel(self, bodies, header=None, footer=None, landscape=False,
+                                  specific_paperformat_args=None):
+        """ Same as ir.actions.report._run_wkhtmltopdf but converting each body in its own wkhtmltopdf process,
+        PDF_WORKERS at a time, the resulting documents being merged. The page numbers of the header and footer
+        restart with each body.
+        """
+        report_obj = self.env['ir.actions.report']
+        if len(bodies) == 1 or self.PDF_WORKERS <= 1:
+            return report_obj._run_wkhtmltopdf(bodies, header=header, footer=footer, landscape=landscape,
+                                               specific_paperformat_args=specific_paperformat_args)
+
+        # everything requiring the database is done before starting the processes
+        paperformat = report_obj.get_paperformat()
+        command_args = report_obj._build_wkhtmltopdf_args(paperformat, landscape, specific_paperformat_args)
+        with tempfile.TemporaryDirectory(prefix='report.branch.tmp.') as tmp_dir:
+            def write_html(name, content):
+                path = os.path.join(tmp_dir, '%s.html' % name)
+                with open(path, 'wb') as html_file:
+                    html_file.write(content.encode() if isinstance(content, str) else content)
+                return path
+
+            for name, content in (('header', header), ('footer', footer)):
+                if content:
+                    command_args += ['--%s-html' % name, write_html(name, content)]
+            body_paths = [write_html('body_%s' % index, body) for index, body in enumerate(bodies)]
+
+            def convert(body_path):
+                pdf_path = body_path[:-len('.html')] + '.pdf'
+                process = subprocess.Popen([_get_wkhtmltopdf_bin()] + command_args + [body_path, pdf_path],
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                out, err = process.communicate()
+                # as in _run_wkhtmltopdf, 1 is returned for the warnings
+                if process.returncode not in (0, 1):
+                    raise UserError(_('Wkhtmltopdf failed (error code: %s). Message: %s') % (
+                        process.returncode, ustr(err[-1000:])))
+                return pdf_path
+
+            with ThreadPoolExecutor(max_workers=self.PDF_WORKERS) as executor:
+                pdf_paths = list(executor.map(convert, body_paths))
+
+            pdf_contents = []
+            for pdf_path in pdf_paths:
+                with open(pdf_path, 'rb') as pdf_file:
+                    pdf_contents.append(pdf_file.read())
+        return merge_pdf(pdf_contents)
+
     def print_xlsx(self, options):
         return {
             'type': 'ir_actions_account_report_download',
@@ -1492,10 +1969,65 @@ class AccountReport(models.AbstractModel):
                      }
         }
 
-    def get_xlsx(self, options, response=None):
-        output = io.BytesIO()
+    def get_xlsx(self, options, response=None, table=None):
+        """ Generate the xlsx export in a temporary file. When a response is given, the file is streamed into it by
+        chunks and nothing is returned, otherwise its whole content is returned (use _get_export_file to get the
+        file itself).
+
+        The rows are flushed to the file one by one, but the lines of the report are computed at once, see
+        _get_export_table: the memory used still grows with the number of lines.
+        """
+        with tempfile.TemporaryFile() as output:
+            self._write_xlsx(options, output, table=table)
+            output.seek(0)
+            if response is not None:
+                shutil.copyfileobj(output, response.stream, self.FILE_CHUNK_SIZE)
+                return None
+            return output.read()
+
+    def _get_export_table(self, options):
+        """ Headers and lines of the printed report, computed once and shared by all the export renderers (get_xlsx,
+        get_pdf): the cells hold both the displayed string and the raw value, see _build_cell. The result must not
+        be modified by the renderers.
+        """
+        report = self.with_context(self._set_context(options))
+        return report.with_context(print_mode=True, prefetch_fields=False)._get_table_with_cache(options)
+
+    def _get_export_renderers(self):
+        """ Output formats able to render an export table, see _get_export_table. """
+        return {
+            'pdf': self.get_pdf,
+            'xlsx': self.get_xlsx,
+        }
+
+    def _get_export_file(self, options, output_format, table=None):
+        """ Return a temporary file holding the export of the report in the given format, ready to be read. The
+        caller is responsible for closing it.
+
+        :param table: An optional export table to render, see _get_export_table.
+        """
+        output = tempfile.TemporaryFile()
+        try:
+            renderer = self._get_export_renderers().get(output_format)
+            if output_format == 'xlsx':
+                self._write_xlsx(options, output, table=table)
+            elif renderer and table is not None:
+                content = renderer(options, table=table) or b''
+                output.write(content.encode() if isinstance(content, str) else content)
+            else:
+                content = getattr(self, 'get_%s' % output_format)(options) or b''
+                output.write(content.encode() if isinstance(content, str) else content)
+            output.seek(0)
+        except Exception:
+            output.close()
+            raise
+        return output
+
+    def _write_xlsx(self, options, output, table=None):
+        # constant_memory: each row is flushed to disk as soon as the next one is started, the rows must be written
+        # in order
         workbook = xlsxwriter.Workbook(output, {
-            'in_memory': True,
+            'constant_memory': True,
             'strings_to_formulas': False,
         })
         sheet = workbook.add_worksheet(self._get_report_name()[:31])
@@ -1528,7 +2060,9 @@ class AccountReport(models.AbstractModel):
         sheet.set_column(0, 0, 50)
 
         y_offset = 0
-        headers, lines = self.with_context(no_format=True, print_mode=True, prefetch_fields=False)._get_table(options)
+        headers, lines = table if table is not None else self._get_export_table(options)
+        # format of the dates of the cells not built with _build_cell
+        date_format = (self.env['res.lang']._lang_get(self.env.user.lang) or get_lang(self.env)).date_format
 
         # Add headers.
         for header in headers:
@@ -1547,12 +2081,12 @@ class AccountReport(models.AbstractModel):
         if options.get('hierarchy'):
             lines = self._create_hierarchy(lines, options)
         if options.get('selected_column'):
-            lines = self._sort_lines(lines, options)
+            lines = self._sort_lines(lines, options, limit=options.get('top_lines'))
 
         # Add lines.
-        for y in range(0, len(lines)):
-            level = lines[y].get('level')
-            if lines[y].get('caret_options'):
+        for y, line in enumerate(lines):
+            level = line.get('level')
+            if line.get('caret_options'):
                 style = level_3_style
                 col1_style = level_3_col1_style
             elif level == 0:
@@ -1564,53 +2098,64 @@ class AccountReport(models.AbstractModel):
                 col1_style = style
             elif level == 2:
                 style = level_2_style
-                col1_style = 'total' in lines[y].get('class', '').split(
+                col1_style = 'total' in line.get('class', '').split(
                     ' ') and level_2_col1_total_style or level_2_col1_style
             elif level == 3:
                 style = level_3_style
-                col1_style = 'total' in lines[y].get('class', '').split(
+                col1_style = 'total' in line.get('class', '').split(
                     ' ') and level_3_col1_total_style or level_3_col1_style
             else:
                 style = default_style
                 col1_style = default_col1_style
 
             # write the first column, with a specific style to manage the indentation
-            cell_type, cell_value = self._get_cell_type_value(lines[y])
+            cell_type, cell_value = self._get_cell_type_value(line, date_format=date_format)
             if cell_type == 'date':
                 sheet.write_datetime(y + y_offset, 0, cell_value, date_default_col1_style)
+            elif cell_type in ('numeric', 'currency'):
+                sheet.write_number(y + y_offset, 0, cell_value, col1_style)
             else:
-                sheet.write(y + y_offset, 0, cell_value, col1_style)
+                sheet.write_string(y + y_offset, 0, cell_value, col1_style)
 
             # write all the remaining cells
-            for x in range(1, len(lines[y]['columns']) + 1):
-                cell_type, cell_value = self._get_cell_type_value(lines[y]['columns'][x - 1])
+            for x in range(1, len(line['columns']) + 1):
+                col = x + line.get('colspan', 1) - 1
+                cell_type, cell_value = self._get_cell_type_value(line['columns'][x - 1], date_format=date_format)
                 if cell_type == 'date':
-                    sheet.write_datetime(y + y_offset, x + lines[y].get('colspan', 1) - 1, cell_value,
-                                         date_default_style)
+                    sheet.write_datetime(y + y_offset, col, cell_value, date_default_style)
+                elif cell_type in ('numeric', 'currency'):
+                    sheet.write_number(y + y_offset, col, cell_value, style)
                 else:
-                    sheet.write(y + y_offset, x + lines[y].get('colspan', 1) - 1, cell_value, style)
+                    sheet.write_string(y + y_offset, col, cell_value, style)
 
         workbook.close()
-        output.seek(0)
-        generated_file = output.read()
-        output.close()
-
-        return generated_file
-
-    def _get_cell_type_value(self, cell):
-        if 'date' not in cell.get('class', '') or not cell.get('name'):
-            # cell is not a date
-            return ('text', cell.get('name', ''))
-        if isinstance(cell['name'], (float, datetime.date, datetime.datetime)):
-            # the date is xlsx compatible
-            return ('date', cell['name'])
-        try:
-            # the date is parsable to a xlsx compatible date
-            lg = self.env['res.lang']._lang_get(self.env.user.lang) or get_lang(self.env)
-            return ('date', datetime.datetime.strptime(cell['name'], lg.date_format))
-        except:
-            # the date is not parsable thus is returned as text
-            return ('text', cell['name'])
+
+    def _get_cell_type_value(self, cell, date_format=None):
+        """ Return the type of a cell (see CELL_TYPES) and the native value the exporters write for it: the raw value
+        of the typed cells, guessed from the raw value or the css classes for the others.
+
+        :param date_format: The strptime format of the dates of the cells not built with _build_cell.
+        """
+        cell_type = cell.get('type')
+        value = cell.get('no_format')
+        if cell_type is None:
+            # cells not built with _build_cell
+            value = cell.get('no_format', cell.get('name'))
+            if 'date' in cell.get('class', '') and value:
+                if isinstance(value, (float, datetime.date, datetime.datetime)):
+                    # the date is xlsx compatible
+                    return 'date', value
+                try:
+                    return 'date', datetime.datetime.strptime(value, date_format or get_lang(self.env).date_format)
+                except (TypeError, ValueError):
+                    # the date is not parsable thus is returned as text
+                    return 'text', ustr(value)
+            cell_type = 'numeric' if isinstance(value, (int, float)) and not isinstance(value, bool) else 'text'
+        if cell_type in ('numeric', 'currency') and isinstance(value, (int, float)):
+            return cell_type, value
+        if cell_type == 'date' and value:
+            return cell_type, fields.Date.to_date(value)
+        return 'text', ustr(cell.get('name') or '')
 
     def print_xml(self, options):
         return {
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import psycopg2
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+# company_id used for the changes that are not bound to a company (renaming a branch, moving a group, ...)
+ALL_COMPANIES = 0
+
+
+class BranchReportMemoryCache(object):
+    """ Process-wide LRU of serialized payloads (report results, rendered html), bounded by their total size. """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload):
+        if len(payload) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self.max_size:
+                _key, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class BranchReportCache(models.Model):
+    """ Shared tier of the report cache: serialized results of branch.report._get_table/_get_lines, readable by every
+    worker. The keys embed a data version stamp, see _get_data_version(), so the entries never need to be
+    invalidated: stale ones are simply not looked up anymore and are garbage collected by a cron.
+
+    The in-process tier (MEMORY_CACHE) sits in front of it.
+    """
+    _name = 'branch.report.cache'
+    _description = 'Branch Report Cache'
+    _log_access = False
+
+    MEMORY_CACHE = BranchReportMemoryCache(64 * 1024 * 1024)
+    # Number of days a shared entry is kept.
+    CACHE_LIFETIME = 7
+
+    key = fields.Char(required=True, index=True, readonly=True)
+    payload = fields.Text(required=True, readonly=True)
+    create_date = fields.Datetime(readonly=True)
+
+    _sql_constraints = [
+        ('key_uniq', 'UNIQUE(key)', 'A report cache key must be unique.'),
+    ]
+
+    def init(self):
+        # Append-only log of the data changes per company and month. Bumping a version only inserts a row so
+        # concurrent transactions never update the same row.
+        self._cr.execute("""
+            CREATE TABLE IF NOT EXISTS branch_report_data_version (
+                company_id INTEGER NOT NULL,
+                month DATE NOT NULL,
+                version BIGINT NOT NULL
+            )
+        """)
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS branch_report_data_version_company_month_idx
+            ON branch_report_data_version (company_id, month)
+        """)
+        self._cr.execute("CREATE SEQUENCE IF NOT EXISTS branch_report_data_version_seq")
+
+    ####################################################
+    # DATA VERSION
+    ####################################################
+
+    @api.model
+    def _bump_data_version(self, company_dates):
+        """ Record a change of the accounting data. The versions are collected and inserted once per transaction,
+        before the commit or before being read, see _flush_data_versions().
+
+        :param company_dates: An iterable of (company_id, date) pairs, company_id being ALL_COMPANIES for changes
+                              impacting every company and date being False for changes impacting every period.
+        """
+        rows = set()
+        for company_id, date in company_dates:
+            month = date and fields.Date.to_date(date).replace(day=1) or datetime.date.min
+            rows.add((company_id or ALL_COMPANIES, month))
+        if not rows:
+            return
+        pending_rows = self._cr.precommit.data.get('branch_report_data_versions')
+        if pending_rows is None:
+            pending_rows = self._cr.precommit.data['branch_report_data_versions'] = set()
+            self._cr.precommit.add(self._flush_data_versions)
+        pending_rows.update(rows)
+        # The results computed by this transaction from now on may never be committed.
+        self._cr.cache['branch_report_data_changed'] = True
+
+    @api.model
+    def _flush_data_versions(self):
+        """ Insert the versions recorded by _bump_data_version() in the transaction. """
+        rows = self._cr.precommit.data.pop('branch_report_data_versions', None)
+        if not rows:
+            return
+        self._cr.execute(
+            "INSERT INTO branch_report_data_version (company_id, month, version) VALUES %s" % ', '.join(
+                ["(%s, %s, nextval('branch_report_data_version_seq'))"] * len(rows)),
+            [value for row in sorted(rows) for value in row],
+        )
+
+    @api.model
+    def _bump_records_data_version(self, records, date_fname='date'):
+        """ Record a change of the given records, holding a company_id and a date field. """
+        self._bump_data_version(
+            (record.company_id.id, record[date_fname]) for record in records
+        )
+
+    @api.model
+    def _get_data_version(self, company_ids, date_to=None):
+        """ Stamp of the data the reports of the given companies up to date_to can depend on.
+
+        The versions are only inserted, a new change in the scope always increases the sum and the count.
+        """
+        month = date_to and fields.Date.to_date(date_to).replace(day=1) or datetime.date.max
+        self._flush_data_versions()
+        self._cr.execute("""
+            SELECT COALESCE(SUM(version), 0), COUNT(*)
+            FROM branch_report_data_version
+            WHERE company_id IN %s AND month <= %s
+        """, [tuple(list(company_ids) + [ALL_COMPANIES]), month])
+        return '%s-%s' % self._cr.fetchone()
+
+    ####################################################
+    # CACHE
+    ####################################################
+
+    @api.model
+    def _make_key(self, values):
+        return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+    @api.model
+    def _get_payload(self, key):
+        key = '%s:%s' % (self._cr.dbname, key)
+        payload = self.MEMORY_CACHE.get(key)
+        if payload is None:
+            self._cr.execute("SELECT payload FROM branch_report_cache WHERE key = %s", [key])
+            row = self._cr.fetchone()
+            if row:
+                payload = row[0]
+                self.MEMORY_CACHE.set(key, payload)
+        return payload
+
+    @api.model
+    def _set_payload(self, key, payload):
+        if self._cr.cache.get('branch_report_data_changed'):
+            # computed from uncommitted data
+            return
+        key = '%s:%s' % (self._cr.dbname, key)
+        self.MEMORY_CACHE.set(key, payload)
+        try:
+            with tools.mute_logger('odoo.sql_db'), self._cr.savepoint():
+                self._cr.execute("""
+                    INSERT INTO branch_report_cache (key, payload, create_date)
+                    VALUES (%s, %s, (now() at time zone 'UTC'))
+                    ON CONFLICT (key) DO NOTHING
+                """, [key, payload])
+        except psycopg2.Error:
+            # another worker stored the same entry concurrently
+            pass
+
+    @api.model
+    def _get_or_compute(self, key, compute):
+        """ Return the cached result for key, calling compute() to get it on a miss. Only the results that survive
+        a JSON round trip are cached.
+        """
+        payload = self._get_payload(key)
+        if payload is not None:
+            return json.loads(payload)
+        result = compute()
+        try:
+            payload = json.dumps(result)
+        except (TypeError, ValueError):
+            return result
+        self._set_payload(key, payload)
+        return json.loads(payload)
+
+    @api.model
+    def _gc_report_cache(self):
+        """ Remove the old shared entries and compact the data versions (preserving their sum per month). """
+        limit_date = fields.Datetime.now() - relativedelta(days=self.CACHE_LIFETIME)
+        self._cr.execute("DELETE FROM branch_report_cache WHERE create_date < %s", [limit_date])
+        self._cr.execute("""
+            WITH compacted AS (
+                DELETE FROM branch_report_data_version
+                WHERE (company_id, month) IN (
+                    SELECT company_id, month FROM branch_report_data_version
+                    GROUP BY company_id, month HAVING COUNT(*) > 1
+                )
+                RETURNING company_id, month, version
+            )
+            INSERT INTO branch_report_data_version (company_id, month, version)
+            SELECT company_id, month, SUM(version) FROM compacted GROUP BY company_id, month
+        """)
+        self.MEMORY_CACHE.clear()
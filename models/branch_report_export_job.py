@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+
+import psycopg2
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, _
+
+_logger = logging.getLogger(__name__)
+
+
+class BranchReportExportJob(models.Model):
+    """ Export of a report in one or several formats, generated in background by a cron and saved as attachments.
+
+    The jobs are claimed with FOR UPDATE SKIP LOCKED so any number of crons/workers can process the queue at the
+    same time without generating the same job twice.
+    """
+    _name = 'branch.report.export.job'
+    _description = 'Branch Report Export Job'
+    _order = 'id desc'
+
+    # Hours after which a running job that is not progressing anymore is considered as interrupted.
+    STALE_DELAY = 2
+    # Attempts to gather the children of the parent jobs when their transaction conflicts with another worker.
+    UPDATE_PARENTS_ATTEMPTS = 3
+
+    name = fields.Char(string='Documents Name', required=True, readonly=True)
+    user_id = fields.Many2one('res.users', string='Requested by', required=True, readonly=True,
+                              default=lambda self: self.env.user)
+    company_id = fields.Many2one('res.company', required=True, readonly=True, default=lambda self: self.env.company)
+    report_model = fields.Char(string='Report Model', required=True, readonly=True)
+    report_id = fields.Integer(string='Parent Report Id', readonly=True)
+    # JSON list of {'output_format', 'options', 'mimetype', 'file_name', 'log_options'}, one per file to generate
+    export_data = fields.Text(required=True, readonly=True)
+    # JSON of the context keys the report depends on (allowed companies, language, ...)
+    context_data = fields.Text(readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], required=True, default='pending', readonly=True, index=True)
+    progress = fields.Float(readonly=True, help='Percentage of the files already generated.')
+    attachment_ids = fields.Many2many('ir.attachment', string='Generated Documents', readonly=True)
+    error_message = fields.Text(readonly=True)
+    date_started = fields.Datetime(readonly=True)
+    date_done = fields.Datetime(readonly=True)
+    # A job exporting several formats is split in one child job per format, rendered in parallel.
+    parent_id = fields.Many2one('branch.report.export.job', readonly=True, ondelete='cascade', index=True)
+    child_ids = fields.One2many('branch.report.export.job', 'parent_id', readonly=True)
+    # JSON of the report tables computed by the parent, loaded by its children instead of computing them again
+    table_attachment_id = fields.Many2one('ir.attachment', readonly=True, ondelete='set null')
+
+    @api.model
+    def _get_job_context(self):
+        return {key: self.env.context[key] for key in ('allowed_company_ids', 'lang', 'tz') if key in self.env.context}
+
+    @api.model
+    def _enqueue(self, vals):
+        """ Create a job and wake up the cron processing them. """
+        vals.setdefault('context_data', json.dumps(self._get_job_context()))
+        job = self.create(vals)
+        self.env.ref('pcp_acc_nassag.ir_cron_branch_report_export_job').sudo()._trigger()
+        return job
+
+    def _get_report_obj(self):
+        self.ensure_one()
+        # the context is replaced, not extended: the jobs exporting the same report must share the cache keys
+        context = json.loads(self.context_data or '{}')
+        model = self.env[self.report_model].with_user(self.user_id).with_context(context)
+        if self.report_id:
+            return model.browse(self.report_id)
+        return model
+
+    ####################################################
+    # PROCESSING
+    ####################################################
+
+    @api.model
+    def _cron_process_jobs(self, limit=10):
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        self._fail_stale_jobs(auto_commit=auto_commit)
+        for __ in range(limit):
+            job = self._claim_next_job()
+            if not job:
+                break
+            if auto_commit:
+                # release the lock, the job is now flagged as running
+                self.env.cr.commit()
+            job._process(auto_commit=auto_commit)
+        self._update_parent_jobs(auto_commit=auto_commit)
+
+        if self.search_count([('state', '=', 'pending')]):
+            self.env.ref('pcp_acc_nassag.ir_cron_branch_report_export_job')._trigger()
+
+    @api.model
+    def _claim_next_job(self):
+        self.flush(['state'])
+        self.env.cr.execute("""
+            SELECT id FROM branch_report_export_job
+            WHERE state = 'pending'
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        job.write({'state': 'running', 'progress': 0.0, 'date_started': fields.Datetime.now()})
+        return job
+
+    @api.model
+    def _fail_stale_jobs(self, auto_commit=False):
+        limit_date = fields.Datetime.now() - relativedelta(hours=self.STALE_DELAY)
+        # the parents wait for their children, they are updated with them by _update_parent_jobs
+        stale_jobs = self.search([('state', '=', 'running'), ('write_date', '<', limit_date), ('child_ids', '=', False)])
+        stale_jobs.write({
+            'state': 'failed',
+            'error_message': _('The export has been interrupted.'),
+            'date_done': fields.Datetime.now(),
+        })
+        for job in stale_jobs.filtered(lambda job: not job.parent_id):
+            job._notify_user()
+        self._update_parent_jobs(auto_commit=auto_commit)
+
+    def _process(self, auto_commit=False):
+        self.ensure_one()
+        try:
+            report = self._get_report_obj()
+            exports = json.loads(self.export_data)
+            # The report is computed once per set of options, by the parent when the job is split: the children
+            # (processed by other workers) load its tables.
+            tables = self._load_tables()
+            self._compute_tables(report, exports, tables)
+
+            if len(exports) > 1:
+                self._split(exports, tables)
+                if auto_commit:
+                    self.env.cr.commit()
+                return
+
+            for index, export in enumerate(exports, 1):
+                table = tables.get(json.dumps(export['options'], sort_keys=True))
+                attachment = self._create_attachment(report, export, table=table)
+                self.write({
+                    'attachment_ids': [(4, attachment.id)],
+                    'progress': 100.0 * index / len(exports),
+                })
+                if auto_commit:
+                    self.env.cr.commit()
+            self.write({'state': 'done', 'progress': 100.0, 'date_done': fields.Datetime.now()})
+        except Exception as e:
+            _logger.exception('Export of report %s failed', self.report_model)
+            if auto_commit:
+                self.env.cr.rollback()
+                self.invalidate_cache()
+            self.write({'state': 'failed', 'error_message': str(e), 'date_done': fields.Datetime.now()})
+        # the parents are updated by the crons, see _update_parent_jobs
+        if not self.parent_id:
+            self._notify_user()
+        if auto_commit:
+            self.env.cr.commit()
+
+    @api.model
+    def _compute_tables(self, report, exports, tables):
+        """ Add to tables the export tables of the renderable exports that are not in it yet, by JSON options. """
+        for export in exports:
+            if export['output_format'] in report._get_export_renderers():
+                options_key = json.dumps(export['options'], sort_keys=True)
+                if options_key not in tables:
+                    tables[options_key] = report._get_export_table(export['options'])
+        return tables
+
+    def _load_tables(self):
+        self.ensure_one()
+        if not self.table_attachment_id:
+            return {}
+        return json.loads(self.table_attachment_id.raw)
+
+    def _save_tables(self, tables):
+        """ Save the tables in an attachment shared with the children, return it (if the tables can be saved). """
+        self.ensure_one()
+        if not tables:
+            return self.env['ir.attachment']
+        try:
+            raw = json.dumps(tables).encode()
+        except (TypeError, ValueError):
+            # the children compute the tables themselves
+            return self.env['ir.attachment']
+        return self.env['ir.attachment'].create({
+            'name': '%s.json' % self.name,
+            'raw': raw,
+            'mimetype': 'application/json',
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+
+    def _split(self, exports, tables=None):
+        """ Create one child job per export, to be rendered in parallel by the crons. """
+        self.ensure_one()
+        table_attachment = self._save_tables(tables or {})
+        self.table_attachment_id = table_attachment
+        self.env['branch.report.export.job'].create([{
+            'name': self.name,
+            'user_id': self.user_id.id,
+            'company_id': self.company_id.id,
+            'report_model': self.report_model,
+            'report_id': self.report_id,
+            'export_data': json.dumps([export]),
+            'context_data': self.context_data,
+            'parent_id': self.id,
+            'table_attachment_id': table_attachment.id,
+        } for export in exports])
+        self.env.ref('pcp_acc_nassag.ir_cron_branch_report_export_job')._trigger()
+
+    @api.model
+    def _update_parent_jobs(self, auto_commit=False):
+        """ Gather the children of the running parent jobs, in a transaction of its own.
+
+        The children never update their parent themselves: the parents are polled at the end of every cron run and
+        claimed with SKIP LOCKED, a parent being updated by another worker is left to the next run.
+        """
+        for attempt in range(1, self.UPDATE_PARENTS_ATTEMPTS + 1):
+            try:
+                parents, all_claimed = self._claim_running_parents()
+                parents._update_from_children()
+                if not all_claimed:
+                    self.env.ref('pcp_acc_nassag.ir_cron_branch_report_export_job')._trigger()
+                if auto_commit:
+                    self.env.cr.commit()
+                return
+            except psycopg2.extensions.TransactionRollbackError:
+                if not auto_commit:
+                    raise
+                self.env.cr.rollback()
+                self.invalidate_cache()
+                if attempt == self.UPDATE_PARENTS_ATTEMPTS:
+                    _logger.warning('Could not update the parent export jobs, retrying in the next run')
+                    self.env.ref('pcp_acc_nassag.ir_cron_branch_report_export_job')._trigger()
+                    self.env.cr.commit()
+
+    @api.model
+    def _claim_running_parents(self):
+        """ Lock the running parent jobs that are not locked by another worker, return them and whether all of them
+        could be locked.
+        """
+        self.flush(['state', 'parent_id'])
+        self.env.cr.execute("""
+            SELECT id FROM branch_report_export_job parent
+            WHERE state = 'running'
+            AND EXISTS (SELECT 1 FROM branch_report_export_job child WHERE child.parent_id = parent.id)
+        """)
+        parent_ids = [row[0] for row in self.env.cr.fetchall()]
+        if not parent_ids:
+            return self.browse(), True
+        self.env.cr.execute("""
+            SELECT id FROM branch_report_export_job
+            WHERE id IN %s
+            FOR UPDATE SKIP LOCKED
+        """, [tuple(parent_ids)])
+        claimed_ids = [row[0] for row in self.env.cr.fetchall()]
+        parents = self.browse(claimed_ids)
+        parents.invalidate_cache()
+        return parents, len(claimed_ids) == len(parent_ids)
+
+    def _update_from_children(self):
+        """ Gather the documents generated by the children, a job is over once all of them are. """
+        for parent in self:
+            children = parent.child_ids
+            finished_children = children.filtered(lambda child: child.state in ('done', 'failed'))
+            vals = {
+                'attachment_ids': [(6, 0, children.attachment_ids.ids)],
+                'progress': 100.0 * len(finished_children) / len(children),
+            }
+            if finished_children == children:
+                failed_children = children.filtered(lambda child: child.state == 'failed')
+                vals.update({
+                    'state': 'failed' if failed_children else 'done',
+                    'error_message': '\n'.join(failed_children.mapped('error_message')) or False,
+                    'date_done': fields.Datetime.now(),
+                })
+            parent.write(vals)
+            if finished_children == children:
+                # the tables are not needed anymore
+                parent.table_attachment_id.unlink()
+                parent._notify_user()
+
+    def _create_attachment(self, report, export, table=None):
+        """ Generate the file of an export and save it as attachment, from a temporary file to the filestore. """
+        vals = {
+            'name': export['file_name'],
+            'company_id': self.company_id.id,
+            'mimetype': export['mimetype'],
+            'description': json.dumps(export['log_options']),
+        }
+        with report._get_export_file(export['options'], export['output_format'], table=table) as export_file:
+            return self.env['ir.attachment'].with_user(self.user_id)._create_from_file(export_file, vals)
+
+    def _notify_user(self):
+        self.ensure_one()
+        if self.state == 'done':
+            title = _('Export ready')
+            message = _('The documents "%s" have been generated.') % self.name
+        else:
+            title = _('Export failed')
+            message = _('The documents "%s" could not be generated: %s') % (self.name, self.error_message)
+        self.env['bus.bus'].sendone((self._cr.dbname, 'res.partner', self.user_id.partner_id.id), {
+            'type': 'simple_notification',
+            'title': title,
+            'message': message,
+            'sticky': self.state == 'failed',
+            'warning': self.state == 'failed',
+        })
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+
+from odoo import api, models
+
+
+class IrAttachment(models.Model):
+    _inherit = 'ir.attachment'
+
+    # size of the chunks the files are copied to the filestore by
+    _FILE_CHUNK_SIZE = 64 * 1024
+
+    @api.model
+    def _create_from_file(self, file, vals):
+        """ Create an attachment whose content is read from the given file object. When the attachments are stored in
+        the filestore, the file is hashed and copied by chunks, its content is never loaded as a whole.
+        """
+        file.seek(0)
+        if self._storage() == 'db':
+            return self.create(dict(vals, raw=file.read()))
+
+        sha = hashlib.sha1()
+        file_size = 0
+        for chunk in iter(lambda: file.read(self._FILE_CHUNK_SIZE), b''):
+            sha.update(chunk)
+            file_size += len(chunk)
+        checksum = sha.hexdigest()
+
+        fname = self._file_write_from_file(file, checksum)
+        attachment = self.create(dict(vals, store_fname=fname, db_datas=False))
+        # file_size and checksum are discarded by create/write, they are normally computed from the content
+        self.env.cr.execute("UPDATE ir_attachment SET file_size = %s, checksum = %s WHERE id = %s",
+                            [file_size, checksum, attachment.id])
+        attachment.invalidate_cache(['file_size', 'checksum'])
+        return attachment
+
+    @api.model
+    def _file_write_from_file(self, file, checksum):
+        """ Same as _file_write but copying the content of a file object. """
+        # retro compatibility, keep the existing path
+        fname = checksum[:3] + '/' + checksum
+        if os.path.isfile(self._full_path(fname)):
+            return fname
+        fname = checksum[:2] + '/' + checksum
+        full_path = self._full_path(fname)
+        if os.path.isfile(full_path):
+            # same checksum, same content
+            return fname
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # write a temporary file first, a concurrent reader never sees a partial content
+        tmp_path = '%s.%s.tmp' % (full_path, os.getpid())
+        file.seek(0)
+        with open(tmp_path, 'wb') as fp:
+            shutil.copyfileobj(file, fp, self._FILE_CHUNK_SIZE)
+        os.replace(tmp_path, full_path)
+        # add fname to checklist, in case the transaction aborts
+        self._mark_for_gc(fname)
+        return fname
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+
+class BranchCurrencyRateTable(object):
+    """ Conversion rates of a company at a given date.
+
+    The rates are fetched in batch (one query for every currency not loaded yet) and the table is shared for the
+    rest of the transaction, see res.currency._get_branch_rate_table().
+    """
+
+    def __init__(self, company, date):
+        self.company = company
+        self.date = date
+        self._rates = {}
+
+    def prefetch(self, currencies):
+        """ Load the rates of all the given currencies in a single query. """
+        missing = currencies.filtered(lambda currency: currency.id not in self._rates)
+        if missing:
+            self._rates.update(missing._get_rates(self.company, self.date))
+
+    def get_rate(self, from_currency, to_currency):
+        if from_currency == to_currency:
+            return 1.0
+        self.prefetch(from_currency | to_currency)
+        return self._rates[to_currency.id] / self._rates[from_currency.id]
+
+    def convert(self, amount, from_currency, to_currency, round=True):
+        """ Same as res.currency._convert but without any query once the rates are loaded. """
+        if from_currency == to_currency:
+            converted = amount
+        else:
+            converted = amount * self.get_rate(from_currency, to_currency)
+        return to_currency.round(converted) if round else converted
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    _BRANCH_RATE_TABLES_KEY = 'pcp_acc_nassag.rate_tables'
+
+    def write(self, vals):
+        # the amount formatters of the branch reports are cached, see branch.report._get_amount_formatter
+        self.env['branch.report'].clear_caches()
+        return super(ResCurrency, self).write(vals)
+
+    @api.model
+    def _get_branch_rate_table(self, company, date=None):
+        """ Return the rate table of the company at the given date (today by default), memoized for the rest of
+        the transaction. Call prefetch() on it with all the currencies to convert to fetch their rates at once.
+        """
+        date = fields.Date.to_date(date) or fields.Date.today()
+        rate_tables = self.env.cr.cache.setdefault(self._BRANCH_RATE_TABLES_KEY, {})
+        key = (company.id, date)
+        if key not in rate_tables:
+            rate_tables[key] = BranchCurrencyRateTable(company, date)
+        return rate_tables[key]
+
+    @api.model
+    def _clear_branch_rate_tables(self):
+        self.env.cr.cache.pop(self._BRANCH_RATE_TABLES_KEY, None)
+
+
+class ResCurrencyRate(models.Model):
+    _inherit = 'res.currency.rate'
+
+    def _bump_branch_report_data_version(self):
+        # the reports convert the balances of every period at the rates of the day
+        self.env['branch.report.cache']._bump_data_version((rate.company_id.id, False) for rate in self)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env['res.currency']._clear_branch_rate_tables()
+        rates = super(ResCurrencyRate, self).create(vals_list)
+        rates._bump_branch_report_data_version()
+        return rates
+
+    def write(self, vals):
+        self.env['res.currency']._clear_branch_rate_tables()
+        self._bump_branch_report_data_version()
+        res = super(ResCurrencyRate, self).write(vals)
+        if 'company_id' in vals:
+            self._bump_branch_report_data_version()
+        return res
+
+    def unlink(self):
+        self.env['res.currency']._clear_branch_rate_tables()
+        self._bump_branch_report_data_version()
+        return super(ResCurrencyRate, self).unlink()
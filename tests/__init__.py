@@ -3,3 +3,22 @@
 
 from . import test_account_analytic
 
+from . import test_branch_analytic_balance
+
+from . import test_branch_report_cache
+
+from . import test_branch_analytic_report
+
+from . import test_branch_analytic_default
+
+from . import test_branch_report_export_job
+
+from . import test_ir_attachment
+
+from . import test_account_journal
+
+from . import test_branch_draft_move_count
+
+from . import test_res_currency
+
+from . import test_controllers
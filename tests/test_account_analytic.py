@@ -12,8 +12,8 @@ class TestAccountAnalyticAccount(AccountTestInvoicingCommon):
 
         cls.env.user.write({
             'groups_id': [
-                (4, cls.env.ref('pcp_acc_nassag.group_analytic_accounting').id),
-                (4, cls.env.ref('pcp_acc_nassag.group_analytic_accounting').id),
+                (4, cls.env.ref('analytic.group_analytic_accounting').id),
+                (4, cls.env.ref('pcp_acc_nassag.group_analytic_branching').id),
             ],
         })
 
@@ -56,3 +56,101 @@ class TestAccountAnalyticAccount(AccountTestInvoicingCommon):
 
         # Making the analytic tag not company dependent is allowed.
         self.test_analytic_tag.company_id = False
+
+    def test_read_group_amounts(self):
+        ''' Ensure the amounts of the grouped analytic accounts are the sums of the amounts of their accounts '''
+        group_1, group_2 = self.env['branch.analytic.group'].create([{'name': 'group_1'}, {'name': 'group_2'}])
+        accounts = self.env['res.branch'].create([
+            {'name': 'account_1', 'group_id': group_1.id},
+            {'name': 'account_2', 'group_id': group_1.id},
+            {'name': 'account_3', 'group_id': group_2.id},
+        ])
+        self.env['branch.analytic.line'].create([{
+            'name': 'test_line',
+            'date': '2019-01-01',
+            'amount': amount,
+            'account_id': account.id,
+            'account': self.company_data['default_account_revenue'].id,
+        } for account, amount in zip(accounts + accounts, [100.0, -30.0, 50.0, -10.0, 20.0, 5.0])])
+
+        domain = [('id', 'in', accounts.ids)]
+        res = self.env['res.branch'].read_group(domain, ['balance', 'debit', 'credit'], ['group_id'],
+                                                orderby='group_id')
+        self.assertEqual([(row['group_id'][0], row['debit'], row['credit'], row['balance']) for row in res], [
+            (group_1.id, 40.0, 120.0, 80.0),
+            (group_2.id, 0.0, 55.0, 55.0),
+        ])
+        # same as summing the accounts of each group
+        for row in res:
+            group_accounts = self.env['res.branch'].search(row['__domain'])
+            for fname in ('balance', 'debit', 'credit'):
+                self.assertAlmostEqual(row[fname], sum(group_accounts.mapped(fname)))
+
+    def test_archived_distribution_tag(self):
+        ''' Ensure the distribution of an archived tag still set on a journal item is applied when posting '''
+        distribution_tag = self.env['branch.analytic.tag'].create({
+            'name': 'test_distribution_tag',
+            'active_analytic_distribution': True,
+            'analytic_distribution_ids': [(0, 0, {'account_id': self.test_analytic_account.id, 'percentage': 40.0})],
+        })
+        move = self.env['account.move'].create({
+            'move_type': 'entry',
+            'date': '2019-01-01',
+            'line_ids': [
+                (0, 0, {
+                    'name': 'line_debit',
+                    'account_id': self.company_data['default_account_revenue'].id,
+                    'debit': 100.0,
+                    'branch_analytic_tag_ids': [(6, 0, distribution_tag.ids)],
+                }),
+                (0, 0, {
+                    'name': 'line_credit',
+                    'account_id': self.company_data['default_account_revenue'].id,
+                    'credit': 100.0,
+                }),
+            ],
+        })
+        move_line = move.line_ids.filtered('branch_analytic_tag_ids')
+
+        distribution_tag.active = False
+        self.assertIn(distribution_tag.id, self.env['branch.analytic.tag']._get_distribution_map())
+        self.assertEqual(move_line._get_branch_analytic_tag_ids(), [])
+
+        move.action_post()
+        analytic_lines = self.env['branch.analytic.line'].search([('move_id', 'in', move.line_ids.ids)])
+        self.assertRecordValues(analytic_lines, [
+            {'account_id': self.test_analytic_account.id, 'amount': -40.0, 'move_id': move_line.id},
+        ])
+
+    def test_analytic_group_closure(self):
+        Group = self.env['branch.analytic.group']
+        group_a = Group.create({'name': 'A'})
+        group_b = Group.create({'name': 'B', 'parent_id': group_a.id})
+        group_c = Group.create({'name': 'C', 'parent_id': group_b.id})
+        group_d = Group.create({'name': 'D'})
+
+        def closure(groups):
+            self.env.cr.execute("""
+                SELECT ancestor_id, descendant_id, depth FROM branch_analytic_group_closure
+                WHERE descendant_id IN %s ORDER BY descendant_id, depth
+            """, [tuple(groups.ids)])
+            return self.env.cr.fetchall()
+
+        self.assertEqual(closure(group_c), [(group_c.id, group_c.id, 0), (group_b.id, group_c.id, 1),
+                                            (group_a.id, group_c.id, 2)])
+        self.assertEqual(sorted(group_a._get_descendant_ids()), sorted((group_a | group_b | group_c).ids))
+        self.assertEqual(sorted(group_c._get_ancestor_ids()), sorted((group_a | group_b | group_c).ids))
+        self.assertEqual(group_c.complete_name, 'A / B / C')
+
+        # moving a group moves its subtree, the complete names of the descendants are updated in SQL
+        group_b.parent_id = group_d
+        self.assertEqual(closure(group_c), [(group_c.id, group_c.id, 0), (group_b.id, group_c.id, 1),
+                                            (group_d.id, group_c.id, 2)])
+        self.assertEqual(group_a._get_descendant_ids(), group_a.ids)
+        group_d.name = 'E'
+        self.assertEqual((group_b | group_c).mapped('complete_name'), ['E / B', 'E / B / C'])
+
+        # the subtree is removed with its root
+        group_d.unlink()
+        self.assertFalse((group_b | group_c).exists())
+        self.assertEqual(closure(group_b | group_c | group_d), [])
@@ -0,0 +1,23 @@
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestAccountJournal(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.env.user.company_id = cls.company_data['company']
+        cls.report = cls.env['branch.analytic.report']
+
+    def test_filter_journals_cache(self):
+        journals = self.report._get_filter_journals()
+        new_journal = self.env['account.journal'].create({
+            'name': 'test_journal',
+            'code': 'TJRNL',
+            'type': 'general',
+            'company_id': self.company_data['company'].id,
+        })
+        self.assertEqual(self.report._get_filter_journals(), journals | new_journal)
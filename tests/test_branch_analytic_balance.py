@@ -0,0 +1,155 @@
+from unittest.mock import patch
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.addons.pcp_acc_nassag.models.analytic_branch import BranchAnalyticLine
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBranchAnalyticDailyBalance(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.env.user.company_id = cls.company_data['company']
+        cls.branch_group = cls.env['branch.analytic.group'].create({'name': 'test_branch_group'})
+        cls.branch = cls.env['res.branch'].create({'name': 'test_branch', 'group_id': cls.branch_group.id})
+
+    def _create_line(self, amount, date='2019-01-01'):
+        return self.env['branch.analytic.line'].create({
+            'name': 'test_line',
+            'date': date,
+            'amount': amount,
+            'account_id': self.branch.id,
+            'account': self.company_data['default_account_revenue'].id,
+        })
+
+    def test_daily_balance_follows_lines(self):
+        DailyBalance = self.env['branch.analytic.daily.balance']
+        line_1 = self._create_line(100.0)
+        line_2 = self._create_line(-30.0)
+        line_3 = self._create_line(50.0, date='2019-01-02')
+
+        # the changes are appended as deltas, never updating the rows of the other transactions
+        balances = DailyBalance.search([('account_id', '=', self.branch.id)], order='date, id')
+        self.assertEqual(len(balances), 3)
+        self.assertEqual(DailyBalance.check_consistency(), 0)
+
+        DailyBalance._compact()
+        balances = DailyBalance.search([('account_id', '=', self.branch.id)], order='date')
+        self.assertRecordValues(balances, [
+            {'date': line_1.date, 'amount': 70.0, 'debit': 30.0, 'credit': 100.0, 'line_count': 2},
+            {'date': line_3.date, 'amount': 50.0, 'debit': 0.0, 'credit': 50.0, 'line_count': 1},
+        ])
+
+        line_2.amount = -10.0
+        line_3.date = '2019-01-01'
+        line_1.unlink()
+        self.assertEqual(DailyBalance.check_consistency(), 0)
+        DailyBalance._compact()
+        balances = DailyBalance.search([('account_id', '=', self.branch.id)])
+        self.assertRecordValues(balances, [
+            {'date': line_2.date, 'amount': 40.0, 'debit': 10.0, 'credit': 50.0, 'line_count': 2},
+        ])
+        self.assertEqual(DailyBalance.check_consistency(), 0)
+
+    def test_daily_balance_branch_regroup(self):
+        DailyBalance = self.env['branch.analytic.daily.balance']
+        self._create_line(100.0)
+        other_group = self.env['branch.analytic.group'].create({'name': 'other_branch_group'})
+
+        self.branch.group_id = other_group
+        balances = DailyBalance.search([('account_id', '=', self.branch.id)])
+        self.assertRecordValues(balances, [{'group_id': other_group.id, 'amount': 100.0}])
+        self.assertEqual(DailyBalance.check_consistency(), 0)
+
+        self.branch.invalidate_cache()
+        self.assertRecordValues(self.branch, [{'debit': 0.0, 'credit': 100.0, 'balance': 100.0}])
+
+    def test_daily_balance_and_raw_lines_match(self):
+        tag = self.env['branch.analytic.tag'].create({'name': 'test_tag'})
+        lines = self._create_line(100.0) + self._create_line(-30.0) + self._create_line(50.0, date='2019-01-02')
+        lines.write({'tag_ids': [(6, 0, tag.ids)]})
+        # pending changes of the transaction
+        lines[1].amount = -40.0
+
+        domain = [('account_id', '=', self.branch.id), ('date', '>=', '2019-01-01'), ('date', '<=', '2019-01-31')]
+        DailyBalance = self.env['branch.analytic.daily.balance']
+        self.assertTrue(DailyBalance._supports_domain(domain))
+        tag_domain = domain + [('tag_ids', 'in', tag.ids)]
+        self.assertFalse(DailyBalance._supports_domain(tag_domain))
+
+        Branch = self.env['res.branch']
+        expected = [(self.branch.id, self.company_data['currency'].id, 40.0, 150.0)]
+        self.assertEqual(Branch._query_debit_credit_balance(domain), expected)
+        self.assertEqual(Branch._query_debit_credit_balance(tag_domain), expected)
+
+    def test_create_bulk_matches_create(self):
+        Tag = self.env['branch.analytic.tag']
+        Line = self.env['branch.analytic.line']
+        distribution_tag = Tag.create({
+            'name': 'test_distribution_tag',
+            'active_analytic_distribution': True,
+            'analytic_distribution_ids': [(0, 0, {'account_id': self.branch.id, 'percentage': 40.0})],
+        })
+        move = self.env['account.move'].create({
+            'move_type': 'entry',
+            'date': '2019-01-01',
+            'ref': 'test_ref',
+            'line_ids': [
+                (0, 0, {
+                    'name': 'line_debit',
+                    'account_id': self.company_data['default_account_revenue'].id,
+                    'debit': 100.0,
+                    'quantity': 2.0,
+                    'product_id': self.product_a.id,
+                    'partner_id': self.partner_a.id,
+                    'analytic_account_id': self.branch.id,
+                    'branch_analytic_tag_ids': [(6, 0, distribution_tag.ids)],
+                }),
+                (0, 0, {
+                    'name': 'line_credit',
+                    'account_id': self.company_data['default_account_expense'].id,
+                    'credit': 100.0,
+                }),
+            ],
+        })
+        move_line = move.line_ids.filtered('analytic_account_id')
+
+        # the values of create_analytic_lines()
+        distribution = Tag._get_distribution_map()[distribution_tag.id][0]
+        vals_list = move_line._prepare_analytic_line() + [move_line._prepare_analytic_distribution_line(distribution)]
+        with patch.object(BranchAnalyticLine, 'create') as create_mock:
+            bulk_lines = Line._create_bulk(vals_list)
+        create_mock.assert_not_called()
+        orm_lines = Line.create(vals_list)
+
+        fnames = ['name', 'date', 'amount', 'unit_amount', 'account_id', 'account', 'group_id', 'user_id',
+                  'partner_id', 'company_id', 'currency_id', 'product_id', 'product_uom_id', 'general_account_id',
+                  'ref', 'move_id', 'tag_ids']
+        bulk_values, orm_values = (
+            [{fname: values[fname] for fname in fnames} for values in lines.read(fnames)]
+            for lines in (bulk_lines, orm_lines)
+        )
+        self.assertEqual(bulk_values, orm_values)
+        self.assertRecordValues(bulk_lines, [
+            {
+                'amount': -100.0,
+                'group_id': self.branch_group.id,
+                'general_account_id': self.company_data['default_account_revenue'].id,
+                'product_id': self.product_a.id,
+                'ref': 'test_ref',
+                'move_id': move_line.id,
+            },
+            {
+                'amount': -40.0,
+                'group_id': self.branch_group.id,
+                'general_account_id': self.company_data['default_account_revenue'].id,
+                'product_id': self.product_a.id,
+                'ref': 'test_ref',
+                'move_id': move_line.id,
+            },
+        ])
+        self.assertEqual(bulk_lines[1].tag_ids, distribution_tag)
+        self.assertEqual(self.env['branch.analytic.daily.balance'].check_consistency(), 0)
@@ -0,0 +1,88 @@
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+from odoo.tests.common import new_test_user
+
+
+@tagged('post_install', '-at_install')
+class TestBranchAnalyticDefault(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.env.user.groups_id |= cls.env.ref('pcp_acc_nassag.group_analytic_branching')
+        cls.env.user.company_id = cls.company_data['company']
+
+        Default = cls.env['branch.analytic.default']
+        cls.rule_generic = Default.create({'sequence': 1})
+        cls.rule_partner = Default.create({'sequence': 2, 'partner_id': cls.partner_a.id})
+        cls.rule_partner_product = Default.create({
+            'sequence': 3,
+            'partner_id': cls.partner_a.id,
+            'product_id': cls.product_a.id,
+        })
+        cls.rule_partner_dated = Default.create({
+            'sequence': 4,
+            'partner_id': cls.partner_a.id,
+            'date_start': '2019-01-01',
+            'date_stop': '2019-12-31',
+        })
+        # same score as rule_partner, later in sequence
+        cls.rule_partner_bis = Default.create({'sequence': 5, 'partner_id': cls.partner_a.id})
+
+    def test_account_get(self):
+        Default = self.env['branch.analytic.default']
+        partner_id, product_id = self.partner_a.id, self.product_a.id
+        keys_and_rules = [
+            ((None, None, None, None, None, None), self.rule_generic),
+            ((None, partner_id, None, None, '2020-01-01', None), self.rule_partner),
+            ((None, partner_id, None, None, '2019-06-01', None), self.rule_partner_dated),
+            ((None, partner_id, None, None, None, None), self.rule_partner_dated),
+            ((product_id, partner_id, None, None, '2020-01-01', None), self.rule_partner_product),
+            ((product_id, self.partner_b.id, None, None, '2020-01-01', None), self.rule_generic),
+        ]
+        for key, rule in keys_and_rules:
+            self.assertEqual(Default.account_get(*key), rule)
+        self.assertEqual(Default.account_get_multi([key for key, _rule in keys_and_rules]),
+                         [rule for _key, rule in keys_and_rules])
+
+        # the index follows the changes of the rules
+        self.rule_partner_bis.sequence = 0
+        self.assertEqual(Default.account_get(partner_id=partner_id, date='2020-01-01'), self.rule_partner_bis)
+        self.rule_partner_bis.unlink()
+        self.assertEqual(Default.account_get(partner_id=partner_id, date='2020-01-01'), self.rule_partner)
+
+    def test_account_get_deleted_rule(self):
+        Default = self.env['branch.analytic.default']
+        product = self.env['product.product'].create({'name': 'test_product'})
+        rule = Default.create({'sequence': 6, 'product_id': product.id})
+        self.assertEqual(Default.account_get(product_id=product.id), rule)
+
+        # the rule is removed by the database cascade, without going through its unlink()
+        product.unlink()
+        self.assertFalse(rule.exists())
+        self.assertEqual(Default.account_get(product_id=product.id), self.rule_generic)
+        self.assertEqual(Default.account_get_multi([(product.id, None, None, None, None, None)]),
+                         [self.rule_generic])
+
+    def test_account_get_record_rules(self):
+        Default = self.env['branch.analytic.default']
+        restricted_group = self.env['res.groups'].create({'name': 'test_restricted_group'})
+        self.env['ir.rule'].create({
+            'name': 'test_no_partner_rule',
+            'model_id': self.env['ir.model']._get_id('branch.analytic.default'),
+            'groups': [(4, restricted_group.id)],
+            'domain_force': "[('partner_id', '=', False)]",
+        })
+        user = new_test_user(
+            self.env, login='branch_analytic_default_user',
+            groups='base.group_user,pcp_acc_nassag.group_analytic_branching',
+            company_id=self.company_data['company'].id,
+            company_ids=[(6, 0, self.company_data['company'].ids)],
+        )
+        user.groups_id |= restricted_group
+        key = (None, self.partner_a.id, None, None, '2020-01-01', None)
+
+        self.assertEqual(Default.account_get(*key), self.rule_partner)
+        self.assertEqual(Default.with_user(user).account_get(*key), self.rule_generic)
+        self.assertEqual(Default.with_user(user).account_get_multi([key, key]), [self.rule_generic] * 2)
@@ -0,0 +1,267 @@
+import datetime
+import io
+import re
+import time
+import zipfile
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+from odoo.tools.misc import formatLang
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+
+
+@tagged('post_install', '-at_install')
+class TestBranchAnalyticReport(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.env.user.company_id = cls.company_data['company']
+        cls.branch = cls.env['res.branch'].create({'name': 'test_branch'})
+        cls.report = cls.env['branch.analytic.report']
+
+    def _get_options(self):
+        options = self.report._get_options(None)
+        options['date'].update({'date_from': '2019-01-01', 'date_to': '2019-01-31'})
+        options['hierarchy'] = False
+        return options
+
+    def test_lines_pagination(self):
+        page_size = self.report.MAX_LINES
+        self.env['branch.analytic.line'].create([{
+            'name': 'test_line_%s' % i,
+            'date': '2019-01-01',
+            'amount': 1.0,
+            'account_id': self.branch.id,
+            'account': self.company_data['default_account_revenue'].id,
+        } for i in range(page_size + 5)])
+
+        options = self._get_options()
+        lines = self.report._get_lines(options)
+        self.assertEqual(len(lines), page_size + 1)
+        load_more_line = lines[-1]
+        self.assertEqual(load_more_line['id'], 'loadmore_')
+        self.assertEqual(
+            (load_more_line['offset'], load_more_line['progress'], load_more_line['remaining']),
+            (page_size, float(page_size), 5),
+        )
+
+        options.update({
+            'lines_offset': load_more_line['offset'],
+            'lines_progress': load_more_line['progress'],
+            'lines_remaining': load_more_line['remaining'],
+        })
+        lines = self.report._get_lines(options, line_id=load_more_line['id'])
+        self.assertEqual(len(lines), 5)
+        self.assertFalse(any(line['id'].startswith('loadmore_') for line in lines))
+
+        # the printed report is never paginated
+        lines = self.report.with_context(print_mode=True)._get_lines(self._get_options())
+        self.assertEqual(len(lines), page_size + 5)
+
+    def test_options_selected_names(self):
+        partners = self.env['res.partner'].create([{'name': 'test_partner_%s' % i} for i in range(3)])
+        options = {'partner': True, 'partner_ids': partners.ids, 'partner_categories': []}
+        self.report._set_options_selected_names(options)
+        self.assertEqual(options['selected_partner_ids'], partners.mapped('name'))
+
+        # the names are kept for the rest of the transaction
+        with self.assertQueryCount(0):
+            self.report._set_options_selected_names(options)
+
+    def test_account_codes_map(self):
+        company = self.company_data['company']
+        parent_group = self.env['account.group'].create({
+            'name': 'test_parent_group', 'code_prefix_start': '4', 'company_id': company.id,
+        })
+        child_group = self.env['account.group'].create({
+            'name': 'test_child_group', 'code_prefix_start': '40', 'parent_id': parent_group.id, 'company_id': company.id,
+        })
+        account = self.company_data['default_account_revenue']
+        account.group_id = child_group
+
+        codes_map = self.report._get_account_codes_map(account.ids)
+        self.assertEqual(codes_map[account.id], [
+            (parent_group.id, parent_group.display_name),
+            (child_group.id, child_group.display_name),
+        ])
+        self.assertEqual(self.report.get_account_codes(account), codes_map[account.id])
+
+    def test_sort_lines(self):
+        self.env['branch.analytic.line'].create([{
+            'name': 'test_line_%s' % amount,
+            'date': '2019-01-01',
+            'amount': amount,
+            'account_id': self.branch.id,
+            'account': self.company_data['default_account_revenue'].id,
+        } for amount in (20.0, 30.0, 10.0)])
+
+        options = self._get_options()
+        options['selected_column'] = self.report.BALANCE_COLUMN
+        lines = self.report._get_lines(options)
+        self.assertEqual([line['columns'][2]['no_format'] for line in lines], [30.0, 20.0, 10.0])
+
+        options['selected_column'] = -self.report.BALANCE_COLUMN
+        lines = self.report._sort_lines(lines, options, limit=2)
+        self.assertEqual([line['columns'][2]['no_format'] for line in lines], [10.0, 20.0])
+
+        # the top-N lines of the rendered report
+        options['top_lines'] = 2
+        report = self.report.with_context(self.report._set_context(options))
+        __, render_values, __ = report._get_html_render_values(options)
+        self.assertEqual([line['columns'][2]['no_format'] for line in render_values['lines']['lines']], [10.0, 20.0])
+
+    def test_report_context(self):
+        options = self._get_options()
+        report_context = self.report._get_report_context()
+        self.assertEqual(report_context.currency, self.env.company.currency_id)
+        manager = self.report._get_report_manager(options, report_context=report_context)
+        self.assertEqual(report_context.get_report_manager(False), manager)
+        # the contexts are not shared between the calls
+        self.assertIsNot(self.report._get_report_context(), report_context)
+
+        # the search view is not rendered again when only the lines change
+        html = self.report._get_searchview_html(options)
+        with patch.object(type(self.env['ir.ui.view']), '_render_template') as render_template:
+            self.assertEqual(self.report._get_searchview_html(dict(options, unfolded_lines=['test'])), html)
+            render_template.assert_not_called()
+            # but it is for other companies
+            report = self.report.with_context(allowed_company_ids=self.company_data_2['company'].ids)
+            report._get_searchview_html(options)
+            render_template.assert_called_once()
+            # and when the views change
+            self.env['ir.ui.view'].clear_caches()
+            self.report._get_searchview_html(options)
+            self.assertEqual(render_template.call_count, 2)
+
+    def test_amount_formatter(self):
+        amounts = [0.0, -0.001, 1.5, -1234567.891, 1e12]
+        for currency in (self.env.company.currency_id, self.currency_data['currency']):
+            self.assertEqual(self.report.format_values(amounts, currency=currency), [
+                formatLang(self.env, abs(amount) if currency.is_zero(amount) else amount, currency_obj=currency)
+                for amount in amounts
+            ])
+        self.assertEqual(self.report.format_value(0.001, blank_if_zero=True), '')
+        self.assertEqual(self.report.with_context(no_format=True).format_values([-0.0, 2.5]), [0.0, 2.5])
+
+    def test_typed_cells(self):
+        cell = self.report._build_cell(-1234.5, 'currency')
+        self.assertEqual(cell['name'], self.report.format_value(-1234.5))
+        self.assertEqual(self.report._get_cell_type_value(cell), ('currency', -1234.5))
+
+        cell = self.report._build_cell(fields.Date.from_string('2019-01-31'), 'date')
+        self.assertEqual(cell['no_format'], '2019-01-31')
+        self.assertEqual(self.report._get_cell_type_value(cell), ('date', fields.Date.from_string('2019-01-31')))
+
+        self.assertEqual(self.report._get_cell_type_value(self.report._build_cell(False)), ('text', ''))
+        # cells built without a type
+        self.assertEqual(self.report._get_cell_type_value({'name': '1,00 €', 'no_format': 1.0}), ('numeric', 1.0))
+        self.assertEqual(self.report._get_cell_type_value({'name': '31/01/2019', 'class': 'date'}, '%d/%m/%Y'),
+                         ('date', datetime.datetime(2019, 1, 31)))
+        self.assertEqual(self.report._get_cell_type_value({'name': 'never', 'class': 'date'}, '%d/%m/%Y'),
+                         ('text', 'never'))
+
+
+    def test_xlsx_export(self):
+        self.env['branch.analytic.line'].create({
+            'name': 'test_line',
+            'date': '2019-01-01',
+            'amount': 123.5,
+            'account_id': self.branch.id,
+            'account': self.company_data['default_account_revenue'].id,
+        })
+        content = self.report.get_xlsx(self._get_options())
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            self.assertIn('xl/worksheets/sheet1.xml', workbook.namelist())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        # the amounts are written as numbers
+        self.assertIn('<v>123.5</v>', sheet)
+
+        # the dates of the first column are written as dates
+        date_format = self.env['res.lang']._lang_get(self.env.user.lang).date_format
+        line = {
+            'id': 1,
+            'name': datetime.date(2019, 1, 31).strftime(date_format),
+            'class': 'date',
+            'level': 3,
+            'columns': [self.report._build_cell(1.0, 'numeric')],
+        }
+        output = io.BytesIO()
+        self.report._write_xlsx(self._get_options(), output, table=([], [line]))
+        with zipfile.ZipFile(output) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        # 2019-01-31 as an excel serial date
+        self.assertIn('<v>43496</v>', sheet)
+
+    def test_group_balances(self):
+        Group = self.env['branch.analytic.group']
+        root = Group.create({'name': 'root', 'company_id': False})
+        child = Group.create({'name': 'child', 'parent_id': root.id, 'company_id': False})
+        grandchild = Group.create({'name': 'grandchild', 'parent_id': child.id, 'company_id': False})
+        # a second company in another currency
+        self.company_data_2['company'].currency_id = self.currency_data['currency']
+
+        for group, company_data, amount, date in [
+            (root, self.company_data, 100.0, '2019-01-10'),
+            (child, self.company_data, -30.0, '2019-01-20'),
+            (grandchild, self.company_data_2, 50.0, '2019-01-15'),
+            (grandchild, self.company_data, 20.0, '2019-01-31'),
+            (grandchild, self.company_data, 1000.0, '2019-02-01'),
+            (Group, self.company_data_2, 7.0, '2019-01-05'),
+        ]:
+            branch = self.env['res.branch'].create({
+                'name': 'test_branch_%s' % group.id,
+                'group_id': group.id,
+                'company_id': company_data['company'].id,
+            })
+            self.env['branch.analytic.line'].create({
+                'name': 'test_line',
+                'date': date,
+                'amount': amount,
+                'account_id': branch.id,
+                'account': company_data['default_account_revenue'].id,
+                'company_id': company_data['company'].id,
+            })
+
+        report = self.report.with_context(
+            allowed_company_ids=(self.company_data['company'] + self.company_data_2['company']).ids)
+        domain = [('date', '>=', '2019-01-01'), ('date', '<=', '2019-01-31')]
+        group_balances = report._get_group_balances(domain)
+        for group in (root, child, grandchild, Group):
+            self.assertAlmostEqual(group_balances[group.id][0], report._get_balance_for_group(group, domain))
+        for group in (root, child, grandchild):
+            self.assertEqual(group_balances[group.id][1], report._get_amount_of_parents(group))
+
+    def test_parallel_pdf_chunks_order(self):
+        bodies = ['<html><body>chunk %s</body></html>' % index for index in range(4)]
+
+        class FakeWkhtmltopdf(object):
+            """ Write a one page pdf whose width is 100 + the index of the body, the first bodies being converted the
+            slowest.
+            """
+            returncode = 0
+
+            def __init__(self, args, **kwargs):
+                body_path, self.pdf_path = args[-2:]
+                self.index = int(re.search(r'body_(\d+)\.html$', body_path).group(1))
+
+            def communicate(self):
+                time.sleep(0.05 * (len(bodies) - self.index))
+                writer = PdfFileWriter()
+                writer.addBlankPage(100 + self.index, 100)
+                with open(self.pdf_path, 'wb') as pdf_file:
+                    writer.write(pdf_file)
+                return b'', b''
+
+        report_module = 'odoo.addons.pcp_acc_nassag.models.branch_report'
+        with patch(report_module + '._get_wkhtmltopdf_bin', return_value='wkhtmltopdf'), \
+                patch(report_module + '.subprocess.Popen', FakeWkhtmltopdf):
+            pdf = self.report._run_wkhtmltopdf_parallel(bodies)
+
+        # the documents are merged in the order of the bodies, not in the order they are converted in
+        reader = PdfFileReader(io.BytesIO(pdf))
+        self.assertEqual([int(reader.getPage(page).mediaBox.getWidth()) for page in range(reader.getNumPages())],
+                         [100, 101, 102, 103])
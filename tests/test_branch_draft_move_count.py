@@ -0,0 +1,39 @@
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBranchDraftMoveDailyCount(AccountTestInvoicingCommon):
+
+    def test_draft_move_count(self):
+        DraftMoveCount = self.env['branch.draft.move.daily.count']
+        company_ids = self.company_data['company'].ids
+        move = self.env['account.move'].create({
+            'move_type': 'entry',
+            'date': '2017-01-15',
+            'line_ids': [
+                (0, 0, {'name': 'line_debit', 'account_id': self.company_data['default_account_revenue'].id, 'debit': 100.0}),
+                (0, 0, {'name': 'line_credit', 'account_id': self.company_data['default_account_expense'].id, 'credit': 100.0}),
+            ],
+        })
+        self.assertTrue(DraftMoveCount._has_draft_moves(company_ids, '2017-01-31'))
+        self.assertFalse(DraftMoveCount._has_draft_moves(company_ids, '2017-01-14'))
+
+        move.action_post()
+        self.assertFalse(DraftMoveCount._has_draft_moves(company_ids, '2017-01-31'))
+
+        move.button_draft()
+        self.assertTrue(DraftMoveCount._has_draft_moves(company_ids, '2017-01-31'))
+
+        # the changes are appended as deltas, never updating the rows of the other transactions
+        counts = DraftMoveCount.search([('company_id', 'in', company_ids), ('date', '=', '2017-01-15')])
+        self.assertEqual(sorted(counts.mapped('move_count')), [-1, 1, 1])
+        DraftMoveCount._compact()
+        counts = DraftMoveCount.search([('company_id', 'in', company_ids), ('date', '=', '2017-01-15')])
+        self.assertEqual(counts.mapped('move_count'), [1])
+        self.assertTrue(DraftMoveCount._has_draft_moves(company_ids, '2017-01-31'))
+
+        move.unlink()
+        self.assertFalse(DraftMoveCount._has_draft_moves(company_ids, '2017-01-31'))
+        DraftMoveCount._compact()
+        self.assertFalse(DraftMoveCount.search([('company_id', 'in', company_ids), ('date', '=', '2017-01-15')]))
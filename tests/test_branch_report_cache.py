@@ -0,0 +1,92 @@
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBranchReportCache(AccountTestInvoicingCommon):
+
+    def test_data_version_follows_changes(self):
+        ReportCache = self.env['branch.report.cache']
+        company_ids = self.company_data['company'].ids
+        version = ReportCache._get_data_version(company_ids, '2019-01-31')
+
+        # a change after the period does not impact it
+        ReportCache._bump_data_version([(company_ids[0], '2019-02-15')])
+        self.assertEqual(ReportCache._get_data_version(company_ids, '2019-01-31'), version)
+
+        ReportCache._bump_data_version([(company_ids[0], '2019-01-15')])
+        new_version = ReportCache._get_data_version(company_ids, '2019-01-31')
+        self.assertNotEqual(new_version, version)
+
+        # a change of the other companies does not impact it, a global change does
+        ReportCache._bump_data_version([(self.company_data_2['company'].id, '2019-01-15')])
+        self.assertEqual(ReportCache._get_data_version(company_ids, '2019-01-31'), new_version)
+        ReportCache._bump_data_version([(False, False)])
+        self.assertNotEqual(ReportCache._get_data_version(company_ids, '2019-01-31'), new_version)
+
+    def test_results_of_changed_data_are_not_cached(self):
+        ReportCache = self.env['branch.report.cache']
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return [{'id': 1, 'name': 'line'}]
+
+        self.env.cr.cache.pop('branch_report_data_changed', None)
+        self.assertEqual(ReportCache._get_or_compute('test_key', compute), [{'id': 1, 'name': 'line'}])
+        self.assertEqual(ReportCache._get_or_compute('test_key', compute), [{'id': 1, 'name': 'line'}])
+        self.assertEqual(len(calls), 1)
+
+        ReportCache._bump_data_version([(False, False)])
+        ReportCache._get_or_compute('other_test_key', compute)
+        ReportCache._get_or_compute('other_test_key', compute)
+        self.assertEqual(len(calls), 3)
+
+    def test_rate_change_changes_data_version(self):
+        ReportCache = self.env['branch.report.cache']
+        company_ids = self.company_data['company'].ids
+        # the closed periods are converted at the rates of the day as well
+        version = ReportCache._get_data_version(company_ids, '2019-01-31')
+        self.env['res.currency.rate'].create({
+            'name': '2019-06-01',
+            'rate': 3.0,
+            'currency_id': self.currency_data['currency'].id,
+            'company_id': company_ids[0],
+        })
+        self.assertNotEqual(ReportCache._get_data_version(company_ids, '2019-01-31'), version)
+
+    def test_master_data_change_changes_data_version(self):
+        ReportCache = self.env['branch.report.cache']
+        company_ids = self.company_data['company'].ids
+        version = ReportCache._get_data_version(company_ids, '2019-01-31')
+        self.company_data['default_account_revenue'].name = 'Renamed Revenue'
+        new_version = ReportCache._get_data_version(company_ids, '2019-01-31')
+        self.assertNotEqual(new_version, version)
+        self.env['account.group'].create({'name': 'test_group', 'code_prefix_start': '99'})
+        self.assertNotEqual(ReportCache._get_data_version(company_ids, '2019-01-31'), new_version)
+
+    def test_data_version_inserted_once_per_transaction(self):
+        ReportCache = self.env['branch.report.cache']
+        company_id = self.company_data['company'].id
+
+        def count_versions():
+            self.env.cr.execute("SELECT COUNT(*) FROM branch_report_data_version")
+            return self.env.cr.fetchone()[0]
+
+        ReportCache._flush_data_versions()
+        count = count_versions()
+        for day in range(1, 11):
+            ReportCache._bump_data_version([(company_id, '2019-01-%02d' % day), (company_id, '2019-02-01')])
+        self.assertEqual(count_versions(), count)
+        self.env.cr.precommit.run()
+        self.assertEqual(count_versions(), count + 2)
+
+    def test_cache_key_context(self):
+        report = self.env['branch.analytic.report']
+        options = report._get_options(None)
+        key = report._get_cache_key('_get_table', options)
+        # the values only used by the client don't change the key
+        self.assertEqual(report.with_context(params={'action': 1}, tz='Europe/Brussels')._get_cache_key(
+            '_get_table', options), key)
+        self.assertNotEqual(report.with_context(lang='fr_FR')._get_cache_key('_get_table', options), key)
+        self.assertNotEqual(report.with_context(print_mode=True)._get_cache_key('_get_table', options), key)
@@ -0,0 +1,75 @@
+import json
+from unittest.mock import patch
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import fields
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBranchReportExportJob(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+
+        cls.env.user.company_id = cls.company_data['company']
+        cls.report = cls.env['branch.analytic.report']
+
+    def _get_options(self):
+        options = self.report._get_options(None)
+        options['date'].update({'date_from': '2019-01-01', 'date_to': '2019-01-31'})
+        options['hierarchy'] = False
+        return options
+
+    def _enqueue_export_job(self, file_names):
+        options = self._get_options()
+        return self.env['branch.report.export.job']._enqueue({
+            'name': 'test_export',
+            'report_model': self.report._name,
+            'export_data': json.dumps([{
+                'output_format': 'xlsx',
+                'options': options,
+                'mimetype': self.report.get_export_mime_type('xlsx'),
+                'file_name': file_name,
+                'log_options': options,
+            } for file_name in file_names]),
+        })
+
+    def test_export_job(self):
+        job = self._enqueue_export_job(['test_export_1.xlsx', 'test_export_2.xlsx'])
+        self.assertEqual(job.state, 'pending')
+
+        # the job is split in one child per file, all of them being processed by the same cron run, and the report
+        # is only computed once, by the parent
+        report_class = type(self.report)
+        with patch.object(report_class, '_get_export_table', autospec=True,
+                          side_effect=report_class._get_export_table) as get_export_table:
+            job._cron_process_jobs()
+        self.assertEqual(get_export_table.call_count, 1)
+        self.assertRecordValues(job, [{'state': 'done', 'progress': 100.0}])
+        self.assertRecordValues(job.child_ids.sorted('id'), [{'state': 'done'}, {'state': 'done'}])
+        self.assertEqual(sorted(job.attachment_ids.mapped('name')), ['test_export_1.xlsx', 'test_export_2.xlsx'])
+        self.assertFalse(job.child_ids.table_attachment_id)
+
+    def test_export_job_stale_child(self):
+        job = self._enqueue_export_job(['test_export_1.xlsx', 'test_export_2.xlsx'])
+        job.state = 'running'
+        job._process()
+        stale_child, child = job.child_ids.sorted('id')
+        self.assertTrue(child.table_attachment_id)
+        child.state = 'running'
+        child._process()
+
+        # the worker processing the other child died
+        job.flush()
+        self.env.cr.execute(
+            "UPDATE branch_report_export_job SET state = 'running', write_date = %s WHERE id = %s",
+            [fields.Datetime.now() - relativedelta(hours=job.STALE_DELAY + 1), stale_child.id])
+        job.invalidate_cache()
+        self.env['branch.report.export.job']._fail_stale_jobs()
+        self.assertRecordValues(stale_child, [{'state': 'failed'}])
+        self.assertRecordValues(job, [{'state': 'failed', 'progress': 100.0}])
+        self.assertEqual(job.attachment_ids.mapped('name'), ['test_export_2.xlsx'])
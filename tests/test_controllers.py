@@ -0,0 +1,43 @@
+import json
+
+from odoo.tests import HttpCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBranchReportController(HttpCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = self.env.ref('base.user_admin')
+        admin.groups_id |= self.env.ref('pcp_acc_nassag.group_analytic_branching')
+        self.report = self.env['branch.analytic.report'].with_user(admin)
+        self.authenticate('admin', 'admin')
+
+    def _get_download_data(self, output_format):
+        return {
+            'model': self.report._name,
+            'options': json.dumps(self.report._get_options(None)),
+            'output_format': output_format,
+            'token': 'test_token',
+        }
+
+    def test_download_report(self):
+        data = self._get_download_data('xlsx')
+        response = self.url_open('/pcp_acc_nassag', data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], self.report.get_export_mime_type('xlsx'))
+        self.assertIn('.xlsx', response.headers['Content-Disposition'])
+        self.assertEqual(int(response.headers['Content-Length']), len(response.content))
+        self.assertTrue(response.content.startswith(b'PK'))
+        self.assertEqual(response.cookies.get('fileToken'), 'test_token')
+
+        # the same export is not generated again as long as the data don't change
+        response = self.url_open('/pcp_acc_nassag', data=data, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+    def test_download_unsupported_format(self):
+        response = self.url_open('/pcp_acc_nassag', data=self._get_download_data('doc'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Odoo Server Error', response.text)
+        self.assertIn('Unsupported export format', response.text)
@@ -0,0 +1,20 @@
+import hashlib
+import tempfile
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestIrAttachment(AccountTestInvoicingCommon):
+
+    def test_attachment_from_file(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b'test_content' * 10000)
+            attachment = self.env['ir.attachment']._create_from_file(file, {
+                'name': 'test_file.txt',
+                'mimetype': 'text/plain',
+            })
+        self.assertEqual(attachment.raw, b'test_content' * 10000)
+        self.assertEqual(attachment.file_size, 120000)
+        self.assertEqual(attachment.checksum, hashlib.sha1(b'test_content' * 10000).hexdigest())
@@ -0,0 +1,36 @@
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBranchRateTable(AccountTestInvoicingCommon):
+
+    def test_rate_table_conversion(self):
+        Currency = self.env['res.currency']
+        company = self.company_data['company']
+        company_currency = company.currency_id
+        foreign_currency = self.currency_data['currency']
+        expected = foreign_currency._convert(100.0, company_currency, company, '2019-01-01')
+
+        # the table is shared for the rest of the transaction, the rates are fetched once
+        rate_table = Currency._get_branch_rate_table(company, '2019-01-01')
+        self.assertIs(Currency._get_branch_rate_table(company, '2019-01-01'), rate_table)
+        rate_table.prefetch(foreign_currency | company_currency)
+        (foreign_currency | company_currency).mapped('rounding')
+        with self.assertQueryCount(0):
+            self.assertEqual(rate_table.convert(100.0, foreign_currency, company_currency), expected)
+            self.assertEqual(rate_table.convert(expected, company_currency, foreign_currency), 100.0)
+            self.assertEqual(rate_table.convert(100.0, company_currency, company_currency), 100.0)
+
+        # the tables are dropped when the rates change
+        self.env['res.currency.rate'].create({
+            'name': '2018-06-01',
+            'rate': 4.0,
+            'currency_id': foreign_currency.id,
+            'company_id': company.id,
+        })
+        new_rate_table = Currency._get_branch_rate_table(company, '2019-01-01')
+        self.assertIsNot(new_rate_table, rate_table)
+        self.assertEqual(new_rate_table.convert(100.0, foreign_currency, company_currency),
+                         foreign_currency._convert(100.0, company_currency, company, '2019-01-01'))
+        self.assertEqual(new_rate_table.convert(100.0, foreign_currency, company_currency), 25.0)
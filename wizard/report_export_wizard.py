@@ -4,7 +4,6 @@
 from odoo import api, models, fields, _
 
 import json
-import base64
 
 
 class ReportExportWizard(models.TransientModel):
@@ -40,45 +39,44 @@ class ReportExportWizard(models.TransientModel):
         return rslt
 
     def export_report(self):
+        """ Queue the generation of the documents, they are attached to the returned job once ready. """
         self.ensure_one()
-        created_attachments = self.env['ir.attachment']
-        for vals in self._get_attachments_to_save():
-            created_attachments |= self.env['ir.attachment'].create(vals)
+        job = self.env['branch.report.export.job']._enqueue(self._get_export_job_vals())
         return {
             'type': 'ir.actions.act_window',
-            'name': _('Generated Documents'),
-            'view_mode': 'kanban,form',
-            'res_model': 'ir.attachment',
-            'domain': [('id', 'in', created_attachments.ids)],
+            'name': _('Export'),
+            'view_mode': 'form',
+            'res_model': 'branch.report.export.job',
+            'res_id': job.id,
+            'target': 'new',
         }
 
-    def _get_attachments_to_save(self):
+    def _get_export_job_vals(self):
         self.ensure_one()
-        to_create_attachments = []
+        report = self._get_report_obj()
+        exports = []
         for format in self.export_format_ids:
             report_action = format.apply_export(self.env.context['account_report_generation_options'])
             output_format = report_action['data']['output_format']
-            report = self._get_report_obj()
             mimetype = report.get_export_mime_type(output_format)
 
             if mimetype is not False: # We let the option to set a None value for it
                 report_options = json.loads(report_action['data']['options'])
-                generation_function = getattr(report, 'get_' + output_format)
                 file_name = self.doc_name or report.get_report_filename(report_options) + '.' + output_format
-                file_content = base64.encodebytes(generation_function(report_options)) # We use the options from the action, as the action may have added or modified stuff into them (see l10n_es_reports, with BOE wizard)
                 log_options_dict = self._get_log_options_dict(report_options)
                 report_options.pop('self', False)
-                to_create_attachments.append(self.get_attachment_vals(file_name, file_content, mimetype, log_options_dict))
-        return to_create_attachments
-
-    def get_attachment_vals(self, file_name, file_content, mimetype, log_options_dict):
-        self.ensure_one()
+                exports.append({
+                    'output_format': output_format,
+                    'options': report_options,
+                    'mimetype': mimetype,
+                    'file_name': file_name,
+                    'log_options': log_options_dict,
+                })
         return {
-            'name': file_name,
-            'company_id': self.env.company.id,
-            'datas': file_content,
-            'mimetype': mimetype,
-            'description': json.dumps(log_options_dict)
+            'name': self.doc_name or report._description,
+            'report_model': self.report_model,
+            'report_id': self.report_id,
+            'export_data': json.dumps(exports),
         }
 
     def _get_report_obj(self):